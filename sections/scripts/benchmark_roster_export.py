@@ -0,0 +1,107 @@
+"""
+Compares the peak memory of loading every section and student, writing the
+rosters CSV to a StringIO and embedding it in a JSON response, as
+export_rosters used to, against streaming it from roster_rows as
+/export/rosters.csv does, for 3,000 students in an in-memory SQLite database.
+"""
+
+import csv
+import os
+import sys
+import tracemalloc
+from io import StringIO
+from json import dumps
+
+from flask import Flask
+
+sys.path.append(os.path.abspath("../server"))
+
+from import_sheet import format_timestamp
+from models import ROSTER_DETAIL, Section, User, db, user_section
+from state import csv_lines, roster_rows
+
+STUDENTS = 3000
+SECTIONS = 100
+COURSE = "cs61a"
+
+app = Flask(__name__)
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+db.init_app(app)
+
+
+def seed():
+    db.create_all()
+    db.session.execute(
+        User.__table__.insert(),
+        [
+            dict(id=i, email=f"staff{i}@berkeley.edu", name=f"Staff {i}", is_staff=True, course=COURSE)
+            for i in range(1, SECTIONS + 1)
+        ]
+        + [
+            dict(id=SECTIONS + i, email=f"student{i}@berkeley.edu", name=f"Student {i}", is_staff=False, course=COURSE)
+            for i in range(1, STUDENTS + 1)
+        ],
+    )
+    db.session.execute(
+        Section.__table__.insert(),
+        [
+            dict(
+                id=i,
+                course=COURSE,
+                name="Lab",
+                staff_id=i,
+                capacity=STUDENTS // SECTIONS,
+                start_time=1629730800 + i * 1800,
+                end_time=1629730800 + i * 1800 + 3600,
+                location=f"Soda {i}",
+            )
+            for i in range(1, SECTIONS + 1)
+        ],
+    )
+    db.session.execute(
+        user_section.insert(),
+        [
+            dict(user_id=SECTIONS + i, section_id=i % SECTIONS + 1)
+            for i in range(1, STUDENTS + 1)
+        ],
+    )
+    db.session.commit()
+
+
+def buffered():
+    # the sections and students, then the CSV text, then the JSON response holding it
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["Student Email", "Staff Email", "Location", "Day", "Start", "Type"])
+    for section in Section.query.filter_by(course=COURSE).options(*ROSTER_DETAIL).all():
+        day, start = format_timestamp(section.start_time)
+        for student in section.students:
+            writer.writerow(
+                [student.email, section.staff.email, section.location, day, start, section.name]
+            )
+    return len(dumps({"custom": {"fileName": "rosters.csv", "rosters": out.getvalue()}}))
+
+
+def streamed():
+    return sum(len(line) for line in csv_lines(roster_rows(COURSE)))
+
+
+def peak(func):
+    db.session.remove()
+    tracemalloc.start()
+    size = func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, peak_bytes
+
+
+with app.app_context():
+    seed()
+    assert "".join(csv_lines(roster_rows(COURSE))).count("\n") == STUDENTS + 1
+    buffered_size, buffered_peak = peak(buffered)
+    streamed_size, streamed_peak = peak(streamed)
+
+print(f"JSON-embedded CSV: {buffered_size / 1024:.0f} KiB sent, {buffered_peak / 1024:.0f} KiB peak")
+print(f"streamed CSV:      {streamed_size / 1024:.0f} KiB sent, {streamed_peak / 1024:.0f} KiB peak "
+      f"({buffered_peak / streamed_peak:.0f}x less)")
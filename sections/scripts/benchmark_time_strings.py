@@ -0,0 +1,72 @@
+"""
+Compares building a zone-aware datetime per call, as parse_time_string and
+export_rosters used to, against the precomputed (day, time) <-> timestamp
+tables, over the times of a 3,000 section sheet.
+"""
+
+import os
+import sys
+from datetime import datetime
+from random import Random
+from timeit import timeit
+
+from zoneinfo import ZoneInfo
+
+sys.path.append(os.path.abspath("../server"))
+
+from import_sheet import DAYS, format_timestamp, parse_time_string
+
+SECTIONS = 3000
+REPEAT = 5
+
+random = Random(61)
+
+
+def old_parse_time_string(day, time):
+    hour, min, ampm = int(time[0:2]), int(time[3:5]), time[5]
+    hour_offset = 12 if hour != 12 and ampm == "p" else 0
+    return datetime(
+        year=2021,
+        month=8,
+        day=23 + DAYS.index(day),
+        hour=hour + hour_offset,
+        minute=min,
+        tzinfo=ZoneInfo("US/Pacific"),
+    ).timestamp()
+
+
+def old_format_timestamp(timestamp):
+    DAY_MAP = {0: "M", 1: "T", 2: "W", 3: "Th", 4: "F"}
+    dt = datetime.fromtimestamp(timestamp, tz=ZoneInfo("America/Los_Angeles"))
+    return DAY_MAP.get(dt.weekday(), ""), dt.strftime("%I:%M%p").lower().replace("m", "")
+
+
+rows = [
+    (
+        random.choice(DAYS),
+        f"{random.choice([8, 9, 10, 11, 12, 1, 2, 3, 4, 5, 6, 7]):02}:{random.choice([0, 30]):02}"
+        + random.choice("ap"),
+    )
+    for _ in range(SECTIONS)
+]
+timestamps = [old_parse_time_string(day, time) for day, time in rows]
+
+assert [parse_time_string(day, time) for day, time in rows] == timestamps
+assert [format_timestamp(timestamp) for timestamp in timestamps] == [
+    old_format_timestamp(timestamp) for timestamp in timestamps
+]
+
+
+def bench(func, args):
+    return timeit(lambda: [func(*arg) for arg in args], number=REPEAT) / REPEAT
+
+
+old_parse = bench(old_parse_time_string, rows)
+new_parse = bench(parse_time_string, rows)
+old_format = bench(old_format_timestamp, [(timestamp,) for timestamp in timestamps])
+new_format = bench(format_timestamp, [(timestamp,) for timestamp in timestamps])
+
+print(f"parse {SECTIONS} times:  {old_parse * 1000:.2f} ms -> {new_parse * 1000:.2f} ms "
+      f"({old_parse / new_parse:.0f}x faster)")
+print(f"format {SECTIONS} times: {old_format * 1000:.2f} ms -> {new_format * 1000:.2f} ms "
+      f"({old_format / new_format:.0f}x faster)")
@@ -0,0 +1,133 @@
+"""
+Serves a fake Canvas API on localhost and checks when the roster cache in
+canvas_service asks it for the course roster: not for a cached student, not
+for a missing one until ROSTER_MISS_TTL has passed, in the background while
+serving the stale roster once ROSTER_TTL has passed, and right away after
+invalidate_roster. Exits with an error if any check fails.
+
+Usage: python check_canvas_roster_cache.py
+"""
+
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from flask import Flask
+
+sys.path.append(os.path.abspath("../server"))
+
+import common.canvas_service as canvas_service
+from common.course_config import get_bcourses_id
+from models import db
+
+TOKEN = "check_canvas_roster_cache"
+
+students = {}  # the fake course's roster, login id -> name
+roster_fetches = []  # paths of the roster requests the fake Canvas served
+
+
+class FakeCanvas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        course_id = int(path.split("/")[4])  # /api/v1/courses/<id>[/enrollments]
+        if path.endswith("/enrollments"):
+            roster_fetches.append(path)
+            body = [
+                {
+                    "id": i,
+                    "course_id": course_id,
+                    "type": "StudentEnrollment",
+                    "user_id": i,
+                    "user": {"id": i, "login_id": login_id, "name": name},
+                }
+                for i, (login_id, name) in enumerate(students.items())
+            ]
+        else:
+            body = {"id": course_id, "name": "CS 61A"}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass  # keep the output to the checks
+
+
+app = Flask(__name__)
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+db.init_app(app)
+
+
+def age_roster(course_id, seconds):
+    canvas_service._rosters[course_id].fetched_at -= seconds
+
+
+def wait_for_refresh(course_id):
+    deadline = time.monotonic() + 5
+    while course_id in canvas_service._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCanvas)
+    Thread(target=server.serve_forever, daemon=True).start()
+    canvas_service.CANVAS_SERVER_URL = f"http://127.0.0.1:{server.server_port}"
+
+    def lookup(*emails):
+        return canvas_service.get_students_from_emails(list(emails), key=TOKEN)
+
+    checks = {}
+    with app.test_request_context():
+        db.create_all()
+        course_id = get_bcourses_id()
+
+        students["oski@berkeley.edu"] = "Oski Bear"
+        found = lookup("oski@berkeley.edu")
+        checks["first lookup fetches the roster"] = (
+            found == {"oski@berkeley.edu": "Oski Bear"} and len(roster_fetches) == 1
+        )
+        lookup("oski@berkeley.edu")
+        checks["cached student"] = len(roster_fetches) == 1
+
+        students["newcomer@berkeley.edu"] = "Newcomer"
+        found = lookup("newcomer@berkeley.edu")
+        checks["missing student within ROSTER_MISS_TTL"] = found == {} and len(roster_fetches) == 1
+        age_roster(course_id, canvas_service.ROSTER_MISS_TTL + 1)
+        found = lookup("newcomer@berkeley.edu")
+        checks["missing student past ROSTER_MISS_TTL"] = (
+            found == {"newcomer@berkeley.edu": "Newcomer"} and len(roster_fetches) == 2
+        )
+
+        students["latecomer@berkeley.edu"] = "Latecomer"
+        age_roster(course_id, canvas_service.ROSTER_TTL + 1)
+        # the roster is past ROSTER_MISS_TTL too, so look up a cached student
+        found = lookup("oski@berkeley.edu")
+        wait_for_refresh(course_id)
+        stale_served = found == {"oski@berkeley.edu": "Oski Bear"}
+        found = lookup("latecomer@berkeley.edu")
+        checks["expired roster"] = (
+            stale_served
+            and found == {"latecomer@berkeley.edu": "Latecomer"}
+            and len(roster_fetches) == 3
+        )
+
+        canvas_service.invalidate_roster(course_id)
+        db.session.commit()
+        lookup("oski@berkeley.edu")
+        checks["invalidated roster"] = len(roster_fetches) == 4
+
+    server.shutdown()
+
+    for name, passed in checks.items():
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
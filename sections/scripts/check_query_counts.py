@@ -0,0 +1,153 @@
+"""
+Counts the statements the hot endpoints run against a seeded in-memory SQLite
+database, and exits with an error if any count differs from EXPECTED, e.g.
+because a loading profile in models.py started loading a relationship lazily
+per row again. Update EXPECTED when a change is meant to alter a count.
+
+Usage: python check_query_counts.py
+"""
+
+import os
+import sys
+
+from flask import Flask
+from flask_login import LoginManager, login_user
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath("../server"))
+
+import jobs
+from common.course_config import get_course
+from models import Attendance, AttendanceStatus, CourseConfig, Section, Session, User, db
+from state import create_state_client
+
+SECTIONS = 30
+STUDENTS_PER_SECTION = 20
+
+# statements per request once the catalog is cached, including loading the user
+EXPECTED = {
+    "refresh_state": 4,
+    "refresh_state since a version": 6,
+    "fetch_section": 5,
+    "join_section": 17,
+}
+
+jobs.WORKERS = 0  # no jobs are enqueued here, and workers would add their own statements
+
+app = Flask(__name__)
+app.secret_key = "check_query_counts"
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+create_state_client(app)
+db.init_app(app)
+
+login_manager = LoginManager()
+login_manager.init_app(app)
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    return User.query.filter_by(id=user_id, course=get_course()).one_or_none()
+
+
+@app.route("/check_query_counts/login/<int:user_id>")
+def login(user_id):
+    login_user(User.query.get(user_id))
+    return ""
+
+
+def seed(course: str):
+    db.create_all()
+    db.session.add(
+        CourseConfig(
+            course=course,
+            can_students_join_lab=True,
+            can_students_change_lab=True,
+        )
+    )
+    staff = User(email="ta@berkeley.edu", name="TA", is_staff=True, is_admin=True, course=course)
+    db.session.add(staff)
+    for i in range(SECTIONS):
+        section = Section(
+            course=course,
+            name="Lab",
+            description=f"Lab {i}",
+            capacity=STUDENTS_PER_SECTION + 5,
+            can_self_enroll=True,
+            start_time=1629730800 + i * 3600,
+            end_time=1629730800 + i * 3600 + 3000,
+            location=f"Soda {i}",
+            staff=staff,
+            tag_string="",
+        )
+        section.students = [
+            User(
+                email=f"student{i * STUDENTS_PER_SECTION + j}@berkeley.edu",
+                name=f"Student {i * STUDENTS_PER_SECTION + j}",
+                is_staff=False,
+                is_admin=False,
+                course=course,
+            )
+            for j in range(STUDENTS_PER_SECTION)
+        ]
+        for week in range(5):
+            session = Session(course=course, start_time=section.start_time + week * 604800)
+            session.section = section
+            for student in section.students:
+                db.session.add(
+                    Attendance(
+                        course=course,
+                        status=AttendanceStatus.present,
+                        session=session,
+                        student=student,
+                    )
+                )
+        db.session.add(section)
+    db.session.commit()
+    return staff.id, section.students[0].id
+
+
+def main():
+    with app.test_request_context():
+        course = get_course()
+    with app.app_context():
+        staff_id, student_id = seed(course)
+
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *_: statements.append(1))
+
+    def count(client, endpoint, **args):
+        statements.clear()
+        response = client.post(f"/api/{endpoint}", json=args).get_json()
+        assert response["success"], response
+        return len(statements), response["data"]
+
+    counts = {}
+    with app.test_client() as client:
+        client.get(f"/check_query_counts/login/{staff_id}")
+        _, state = count(client, "refresh_state")  # loads the catalog
+        counts["refresh_state"], _ = count(client, "refresh_state")
+        counts["refresh_state since a version"], _ = count(
+            client, "refresh_state", version=state["version"]
+        )
+        counts["fetch_section"], _ = count(client, "fetch_section", section_id=1)
+
+    with app.test_client() as client:
+        client.get(f"/check_query_counts/login/{student_id}")
+        count(client, "refresh_state")
+        counts["join_section"], _ = count(client, "join_section", target_section_id=1)
+
+    failed = False
+    for name, expected in EXPECTED.items():
+        if counts[name] != expected:
+            failed = True
+            print(f"FAIL {name}: {counts[name]} statements, expected {expected}")
+        else:
+            print(f"ok   {name}: {counts[name]} statements")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Runs EXPLAIN on the hot lookups of the server and exits with an error if any
+of them would scan a whole table instead of using an index.
+
+Usage: python check_query_plans.py [database url]
+
+Defaults to a fresh in-memory SQLite database. To check MySQL, point it at a
+local MySQL-compatible server, e.g. mysql://root@127.0.0.1/sections, ideally
+holding a copy of the production data so the planner sees realistic sizes.
+The schema is created if it does not exist yet.
+"""
+
+import os
+import sys
+
+from sqlalchemy import and_, create_engine, func, or_, select
+
+sys.path.append(os.path.abspath("../server"))
+
+from models import (
+    Attendance,
+    AttendanceChange,
+    Job,
+    LogVersion,
+    Section,
+    SectionChange,
+    Session,
+    User,
+    db,
+    user_section,
+)
+
+user, section, session, attendance, section_change, job, attendance_change, log_version = (
+    User.__table__,
+    Section.__table__,
+    Session.__table__,
+    Attendance.__table__,
+    SectionChange.__table__,
+    Job.__table__,
+    AttendanceChange.__table__,
+    LogVersion.__table__,
+)
+
+HOT_QUERIES = {
+    "user by email": select([user]).where(
+        and_(user.c.email == "oski@berkeley.edu", user.c.course == "cs61a")
+    ),
+    "section by id": select([section]).where(
+        and_(section.c.id == 1, section.c.course == "cs61a")
+    ),
+    "sections of a course": select([section]).where(section.c.course == "cs61a"),
+    "session by start time": select([session]).where(
+        and_(session.c.start_time == 0, session.c.section_id == 1)
+    ),
+    "attendance of a student in a session": select([attendance]).where(
+        and_(attendance.c.session_id == 1, attendance.c.student_id == 1)
+    ),
+    "attendance history": select([attendance, session.c.start_time])
+    .select_from(attendance.join(session))
+    .where(attendance.c.student_id == 1)
+    .order_by(session.c.start_time),
+    "sections of a user": select([user_section.c.section_id]).where(
+        user_section.c.user_id == 1
+    ),
+    "roster of a section": select([user_section.c.user_id]).where(
+        user_section.c.section_id == 1
+    ),
+    "enrolled counts": select(
+        [user_section.c.section_id, func.count(user_section.c.user_id)]
+    )
+    .where(user_section.c.section_id.in_([1, 2]))
+    .group_by(user_section.c.section_id),
+    "catalog version": select([log_version]).where(
+        and_(log_version.c.log == "section", log_version.c.course == "cs61a")
+    ),
+    "catalog changes": select([section_change.c.section_id]).where(
+        and_(
+            section_change.c.course == "cs61a",
+            section_change.c.version > 0,
+            section_change.c.version <= 10,
+        )
+    ),
+    "attendance changes": select([attendance_change]).where(
+        and_(
+            attendance_change.c.course == "cs61a",
+            attendance_change.c.version > 0,
+            attendance_change.c.version <= 10,
+        )
+    ),
+    "next claimable job": select([job.c.id, job.c.attempts])
+    .where(
+        or_(
+            job.c.status == "queued",
+            and_(job.c.status == "running", job.c.leased_until < 1629730800),
+        )
+    )
+    .order_by(job.c.id)
+    .limit(1),
+}
+
+
+def sqlite_table_scans(connection, sql, params):
+    # e.g. "SCAN user" or "SCAN TABLE user", as opposed to "SEARCH user USING INDEX ..."
+    rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [
+        row[-1]
+        for row in rows
+        if row[-1].startswith("SCAN") and "INDEX" not in row[-1]
+    ]
+
+
+def mysql_table_scans(connection, sql, params):
+    rows = connection.execute(f"EXPLAIN {sql}", params)
+    return [f"{row['table']}: {row['type']}" for row in rows if row["type"] == "ALL"]
+
+
+def main(url):
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    table_scans = (
+        sqlite_table_scans if engine.dialect.name == "sqlite" else mysql_table_scans
+    )
+
+    failed = False
+    with engine.connect() as connection:
+        for name, query in HOT_QUERIES.items():
+            compiled = query.compile(dialect=engine.dialect)
+            params = compiled.construct_params()
+            if compiled.positional:
+                params = tuple(params[key] for key in compiled.positiontup)
+            scans = table_scans(connection, str(compiled), params)
+            if scans:
+                failed = True
+                print(f"FAIL {name}: {', '.join(scans)}")
+            else:
+                print(f"ok   {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "sqlite://")
@@ -0,0 +1,130 @@
+"""
+Change log of attendance, so grade-display can sync only what changed since
+its last export.
+
+Each attendance write appends an AttendanceChange row naming the session and
+student it touched, in the same transaction, tagged with a version from
+log_versions. That version is the export cursor, like it is the catalog
+version of the SectionChange log, and it becomes visible in commit order, so
+an export never moves its cursor past a write that has yet to commit.
+"""
+
+from __future__ import annotations
+
+from itertools import chain
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session as OrmSession
+
+import log_versions
+from models import Attendance, AttendanceChange, Section, Session, User, db
+
+
+ATTENDANCE_LOG = "attendance"  # the LogVersion of the AttendanceChange log
+# versions of the log kept for diffing, an export further behind gets a full one
+ATTENDANCE_LOG_RETENTION = 5000
+ATTENDANCE_LOG_TRIM_INTERVAL = 100  # versions between trims of the log
+
+
+def latest_cursor(course: str) -> int:
+    version, _ = log_versions.current(ATTENDANCE_LOG, course)
+    return version
+
+
+def record_changes(course: str, keys: Optional[Iterable[Tuple[int, int]]] = None):
+    """
+    Logs a write the flush hook cannot see, such as a bulk insert, given the
+    (session_id, student_id) pairs it touched. Passing no pairs marks every
+    attendance of the course as changed, and drops the older log entries
+    since no cursor can be diffed past it.
+    """
+    connection = db.session.connection()
+    if keys is None:
+        _trim_log(connection, course, log_versions.bump(connection, ATTENDANCE_LOG, course))
+    else:
+        _append_changes(connection, course, keys)
+
+
+def _append_changes(connection, course: str, keys: Iterable[Tuple[int, int]]):
+    changes = [
+        dict(session_id=session_id, student_id=student_id) for session_id, student_id in keys
+    ]
+    if not changes:
+        return
+    version = log_versions.bump(connection, ATTENDANCE_LOG, course)
+    connection.execute(
+        AttendanceChange.__table__.insert(),
+        [dict(course=course, version=version, **change) for change in changes],
+    )
+    if version % ATTENDANCE_LOG_TRIM_INTERVAL == 0 and version > ATTENDANCE_LOG_RETENTION:
+        _trim_log(connection, course, version - ATTENDANCE_LOG_RETENTION)
+
+
+def _trim_log(connection, course: str, floor: int):
+    # cursors older than the floor get a full export
+    connection.execute(
+        AttendanceChange.__table__.delete().where(
+            and_(AttendanceChange.course == course, AttendanceChange.version <= floor)
+        )
+    )
+    log_versions.raise_floor(connection, ATTENDANCE_LOG, course, floor)
+
+
+def changes_since(course: str, since: int, until: int) -> Optional[list]:
+    """
+    Returns the (email, section name, section id, start time, status) of every
+    student attendance written after the since cursor, up to the until cursor,
+    with a None status if it was cleared. Returns None if a full export is
+    needed because the log no longer reaches back to the since cursor, e.g.
+    because the whole course changed in between.
+    """
+    change, attendance, user, session, section = (
+        AttendanceChange.__table__,
+        Attendance.__table__,
+        User.__table__,
+        Session.__table__,
+        Section.__table__,
+    )
+    _, floor = log_versions.current(ATTENDANCE_LOG, course)
+    if since < floor:
+        return None
+    in_range = and_(
+        change.c.course == course, change.c.version > since, change.c.version <= until
+    )
+
+    return db.session.execute(
+        select(
+            [
+                user.c.email,
+                section.c.name,
+                session.c.section_id,
+                session.c.start_time,
+                attendance.c.status,
+            ]
+        )
+        .select_from(
+            change.join(user, user.c.id == change.c.student_id)
+            .join(session, session.c.id == change.c.session_id)
+            .outerjoin(section, section.c.id == session.c.section_id)
+            .outerjoin(
+                attendance,
+                and_(
+                    attendance.c.session_id == change.c.session_id,
+                    attendance.c.student_id == change.c.student_id,
+                ),
+            )
+        )
+        .where(and_(in_range, ~user.c.is_staff))
+        .distinct()
+    ).fetchall()
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _record_attendance_changes(session: OrmSession, flush_context):
+    by_course: Dict[str, Set[Tuple[int, int]]] = {}
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Attendance) and (obj not in session.dirty or session.is_modified(obj)):
+            by_course.setdefault(obj.course, set()).add((obj.session_id, obj.student_id))
+    for course, keys in by_course.items():
+        _append_changes(session.connection(), course, keys)
@@ -1,44 +1,307 @@
 from flask import session, request, url_for
 from canvasapi import Canvas
+from canvasapi.exceptions import CanvasException
 from canvasapi.user import User
 from canvasapi.course import Course
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from requests.adapters import HTTPAdapter
+from threading import Lock, Thread
 import os
+import time
 from dotenv import load_dotenv
 from common.course_config import get_bcourses_id
-from models import Failure
+from models import Failure, db
+import log_versions
+
+load_dotenv(override=True)
+CANVAS_SERVER_URL = os.getenv('CANVAS_SERVER_URL')
+# number of access tokens whose clients are kept around
+CLIENT_CACHE_SIZE = int(os.getenv('CANVAS_CLIENT_CACHE_SIZE', 256))
+# keep-alive connections per client, enough for the concurrent calls of one login
+CLIENT_POOL_SIZE = int(os.getenv('CANVAS_CLIENT_POOL_SIZE', 8))
+# members of this bCourses project are admins of every course, for override purposes
+# contact Silas to be added to this course
+OVERRIDE_COURSE_ID = 1549197
+
+_clients: OrderedDict[str, Canvas] = OrderedDict()
+_client_lock = Lock()
+
+def _new_client(key) -> Canvas:
+    client = Canvas(CANVAS_SERVER_URL, key)
+    # canvasapi does not expose the requests.Session each client talks through
+    http = client._Canvas__requester._session
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CLIENT_POOL_SIZE)
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return client
 
 def _get_client(key=None) -> Canvas:
     if not key:
         key = session.get('access_token', None)
     if not key:
         raise Exception('Key and access token not found')
-    load_dotenv(override=True)
-    return Canvas(os.getenv('CANVAS_SERVER_URL'), key)
+    with _client_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+    client = _new_client(key)
+    with _client_lock:
+        client = _clients.setdefault(key, client)
+        _clients.move_to_end(key)
+        while len(_clients) > CLIENT_CACHE_SIZE:
+            _, evicted = _clients.popitem(last=False)
+            evicted._Canvas__requester._session.close()
+    return client
 
-def get_student_from_email(email, key=None):
-    course_id = get_bcourses_id()
-    course = get_course(course_id)
-    students = course.get_enrollments(type=['StudentEnrollment'])
-    for enrollment in students:
+def _generation(name, course_id) -> int:
+    version, _ = log_versions.current(name, str(course_id))
+    return version
+
+def _bump_generation(name, course_id):
+    # applies to every process once the caller commits
+    log_versions.bump(db.session.connection(), name, str(course_id))
+
+# seconds before a cached course roster is refreshed in the background
+ROSTER_TTL = int(os.getenv('CANVAS_ROSTER_TTL', 10 * 60))
+# seconds before a lookup that misses the cached roster refetches it right away
+ROSTER_MISS_TTL = int(os.getenv('CANVAS_ROSTER_MISS_TTL', 60))
+# the LogVersion counting invalidations of a course's cached roster, shared by every process
+ROSTER_GENERATION = "canvas_roster"
+
+@dataclass
+class Roster:
+    by_login_id: dict[str, dict] = field(default_factory=dict)
+    by_user_id: dict[int, dict] = field(default_factory=dict)
+    generation: int = 0 # of the course's roster when it was fetched
+    fetched_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+_rosters: dict[int, Roster] = {}
+_refreshing: set[int] = set()
+_roster_lock = Lock()
+
+def _fetch_roster(course_id, key, generation) -> Roster:
+    roster = Roster(generation=generation)
+    for enrollment in get_course(course_id, key).get_enrollments(type=['StudentEnrollment']):
         student = enrollment.user
-        if email == student["login_id"]:
-            return student["name"]
-    return None # no student found
+        roster.by_login_id[student["login_id"]] = student
+        roster.by_user_id[student["id"]] = student
+    with _roster_lock:
+        _rosters[course_id] = roster
+    return roster
+
+def _refresh_roster(course_id, key, generation):
+    try:
+        _fetch_roster(course_id, key, generation)
+    except Exception:
+        pass # keep serving the stale roster, the next lookup retries
+    finally:
+        with _roster_lock:
+            _refreshing.discard(course_id)
+
+def get_roster(course_id=None, key=None, max_age=None) -> Roster:
+    """ Returns the cached student roster of a course, fetching it on first use.
+
+    Once older than ROSTER_TTL the roster keeps being served while a background
+    thread fetches a fresh copy. Passing max_age instead refetches it right away
+    when it is older than that, as does invalidate_roster in any process.
+
+    Args:
+        course_id (int, optional): Canvas id of the course, defaults to this app's
+        key (str, optional): Canvas access token, defaults to the session's
+        max_age (float, optional): oldest acceptable roster, in seconds
+    """
+    course_id = course_id or get_bcourses_id()
+    key = key or session.get('access_token', None) # background threads have no session
+    generation = _generation(ROSTER_GENERATION, course_id)
+    with _roster_lock:
+        roster = _rosters.get(course_id)
+    if (
+        roster is None
+        or roster.generation != generation
+        or (max_age is not None and roster.age > max_age)
+    ):
+        return _fetch_roster(course_id, key, generation)
+    if roster.age > ROSTER_TTL:
+        with _roster_lock:
+            start = course_id not in _refreshing
+            _refreshing.add(course_id)
+        if start:
+            Thread(target=_refresh_roster, args=(course_id, key, generation), daemon=True).start()
+    return roster
+
+def invalidate_roster(course_id=None):
+    """ Makes every process refetch the roster of the course on its next lookup,
+    once the caller commits. """
+    _bump_generation(ROSTER_GENERATION, course_id or get_bcourses_id())
+
+def get_student_from_email(email, key=None):
+    return get_students_from_emails([email], key).get(email) # None if no student found
+
+def get_students_from_emails(emails, key=None) -> dict[str, str]:
+    """ Returns the names of the students of the course with the given emails.
+
+    Args:
+        emails (list[str]): login ids of the students to look up
+        key (str, optional): Canvas access token, defaults to the session's
+
+    Returns:
+        dict[str, str]: name of each student found, keyed by email, from the
+        cached course roster.
+    """
+    roster = get_roster(key=key)
+    if any(email not in roster.by_login_id for email in emails):
+        # the student may have enrolled since the roster was fetched
+        roster = get_roster(key=key, max_age=ROSTER_MISS_TTL)
+    return {
+        email: roster.by_login_id[email]["name"]
+        for email in emails
+        if email in roster.by_login_id
+    }
+
+# seconds a user's roles are reused without asking Canvas
+ROLE_TTL = int(os.getenv('CANVAS_ROLE_TTL', 60 * 60))
+# the LogVersion counting invalidations of a course's cached roles, shared by every process
+ROLES_GENERATION = "canvas_roles"
+
+@dataclass
+class Roles:
+    is_staff: bool
+    is_admin: bool
+    generation: int = 0 # of the course's roles when they were fetched
+    fetched_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+_roles: dict[tuple[int, int], Roles] = {}
+_role_lock = Lock()
+
+_canvas_pool = ThreadPoolExecutor(max_workers=int(os.getenv('CANVAS_WORKERS', 32)))
+
+def get_roles(course_id, user_id, key=None) -> Roles:
+    """ Returns whether a user is staff and admin of a course, cached for ROLE_TTL
+    or until invalidate_roles is called for the course.
+
+    A miss fetches the user's enrollments in the course and the user's own
+    courses, which tell whether they belong to the override course, at once.
+
+    Args:
+        course_id (int): Canvas id of the course
+        user_id (str | int): Canvas id for the user
+        key (str, optional): Canvas access token, defaults to the session's
+    """
+    cache_key = (int(user_id), int(course_id))
+    generation = _generation(ROLES_GENERATION, course_id)
+    with _role_lock:
+        roles = _roles.get(cache_key)
+    if roles is not None and roles.age < ROLE_TTL and roles.generation == generation:
+        return roles
+
+    key = key or session.get('access_token', None) # the workers have no session
+    enrollments = _canvas_pool.submit(get_enrollments, course_id, user_id, key)
+    courses = _canvas_pool.submit(get_user_courses, user_id, key)
+    is_override = OVERRIDE_COURSE_ID in [c.id for c in courses.result()]
+
+    try:
+        staff, admin = roles_from_enrollments(enrollments.result())
+    except CanvasException: # e.g. override members outside the course
+        if not is_override:
+            raise
+        staff, admin = False, False
+    roles = Roles(is_staff=staff or is_override, is_admin=admin or is_override, generation=generation)
+    with _role_lock:
+        _roles[cache_key] = roles
+    return roles
+
+def invalidate_roles(course_id=None):
+    """ Makes every process refetch the roles of everyone in the course on their
+    next login, once the caller commits. """
+    _bump_generation(ROLES_GENERATION, course_id or get_bcourses_id())
+
+@dataclass
+class LoginInfo:
+    email: str | None
+    name: str | None
+    is_staff: bool
+    is_admin: bool
+
+def get_login_info(user_id, course_id, key=None) -> LoginInfo:
+    """ Fetches everything the login callback needs about a user, concurrently.
+
+    The profile is requested once while the roles are resolved, which skips
+    Canvas entirely when they are still cached.
+
+    Args:
+        user_id (str | int): Canvas id for the user
+        course_id (int): Canvas id of this app's course
+        key (str, optional): Canvas access token, defaults to the session's
+
+    Returns:
+        LoginInfo: email and name from the profile, and the user's roles.
+    """
+    key = key or session.get('access_token', None)
+    profile = _canvas_pool.submit(get_profile, user_id, key)
+    roles = get_roles(course_id, user_id, key)
+    profile = profile.result()
+    return LoginInfo(
+        email=profile.get('primary_email'),
+        name=profile.get('name'),
+        is_staff=roles.is_staff,
+        is_admin=roles.is_admin,
+    )
 
 def get_user(user_id, key=None) -> User:
     return _get_client(key).get_user(user_id)
 
+def get_profile(user_id, key=None) -> dict:
+    # GET users/:id/profile directly, without fetching the user first
+    client = _get_client(key)
+    return User(client._Canvas__requester, {'id': user_id}).get_profile()
+
+def get_enrollments(course_id, user_id=None, key=None) -> list:
+    # GET courses/:id/enrollments directly, without fetching the course first
+    client = _get_client(key)
+    course = Course(client._Canvas__requester, {'id': course_id})
+    if user_id is None:
+        return list(course.get_enrollments())
+    return list(course.get_enrollments(user_id=str(user_id)))
+
 def get_course(course_id, key=None) -> Course:
     return _get_client(key).get_course(course_id)
 
 def get_email(user_id, key=None) -> str | None:
-    return get_user(user_id).get_profile().get('primary_email')
+    return get_profile(user_id, key).get('primary_email')
 
 def get_name(user_id, key=None) -> str | None:
-    return get_user(user_id).get_profile().get('name')
+    return get_profile(user_id, key).get('name')
 
 def get_user_courses(user_id, key=None) -> list[Course]:
-    return [c for c in get_user(user_id).get_courses(enrollment_status='active', include=['term'], per_page=100)]
+    return [c for c in get_user(user_id, key).get_courses(enrollment_status='active', include=['term'], per_page=100)]
+
+def roles_from_enrollments(enrollments) -> tuple[bool, bool]:
+    """ Returns whether enrollments in a course make a user staff and admin.
+
+    Args:
+        enrollments (list[Enrollment]): CanvasAPI enrollments of one user
+
+    Returns:
+        tuple[bool, bool]: is_staff and is_admin, ignoring the override course.
+    """
+    staff_types = ["TaEnrollment", "TeacherEnrollment"]
+    staff, admin = False, False
+    for e in enrollments:
+        staff = staff or e.type in staff_types
+        # admin privilege assigned if enrolled as a teacher or lead TA on bCourses
+        admin = admin or e.type == "TeacherEnrollment" or e.role == "Lead TA"
+    return staff, admin
 
 def is_staff(course, user_id):
     """ Returns whether a user is a TA or Teacher of the given course.
@@ -50,13 +313,7 @@ def is_staff(course, user_id):
     Returns:
         bool: True if user has staff role in course.
     """
-    for e in course.get_enrollments(user_id=str(user_id)):
-        staff_types = ["TaEnrollment", "TeacherEnrollment"]
-        if e.type in staff_types:
-            return True
-    if 1549197 in [c.id for c in get_user_courses(user_id)]:
-        return True
-    return False
+    return get_roles(course.id, user_id).is_staff
 
 def is_admin(course, user_id):
     """ Returns whether a user is a Teacher or Lead TA of the given course.
@@ -68,12 +325,5 @@ def is_admin(course, user_id):
     Returns:
         bool: True if user has admin role in course.
     """
-    # admin privilege assigned if enrolled as a teacher or lead TA on bCourses
-    for e in course.get_enrollments(user_id=str(user_id)):
-        if e.type == "TeacherEnrollment" or e.role == "Lead TA":
-            return True
-    # admin privilege assigned if enrolled in bCourses project for override purposes
-    # contact Silas to be added to this course
-    if 1549197 in [c.id for c in get_user_courses(user_id)]:
-        return True
-    return False
+    # admin privilege also assigned if enrolled in bCourses project for override purposes
+    return get_roles(course.id, user_id).is_admin
@@ -0,0 +1,364 @@
+"""
+In-process cache of every course's section catalog.
+
+Each write touching a section appends SectionChange rows in the same
+transaction, tagged with a version from log_versions that becomes visible in
+commit order. That version doubles as the catalog version, so every worker
+can bring its cache up to date by reloading only the sections logged since
+the version it last saw.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from hashlib import sha1
+from heapq import merge
+from itertools import chain
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session as OrmSession, attributes
+
+import log_versions
+from models import (
+    ROSTER_DETAIL,
+    Section,
+    SectionChange,
+    User,
+    VisibilityContext,
+    anonymous_json,
+    db,
+    user_section,
+)
+
+USER_JSON_COLUMNS = ("name", "email", "is_staff", "is_admin")
+SECTION_LOG = "section"  # the LogVersion of the SectionChange log
+# versions of the log kept for diffing, a client further behind gets a full snapshot
+SECTION_LOG_RETENTION = 500
+SECTION_LOG_TRIM_INTERVAL = 50  # versions between trims of the log
+
+# sections are listed by ascending score
+BIG = 10000
+UNSTAFFED_BOOST = BIG * 100  # only applies when staff are viewing
+OWN_SECTION_BOOST = BIG * 10
+
+
+@dataclass(frozen=True)
+class CachedPerson:
+    id: int
+    is_staff: bool
+    json: dict
+
+    @classmethod
+    def from_user(cls, user: User) -> CachedPerson:
+        return cls(id=user.id, is_staff=user.is_staff, json=user.unredacted_json)
+
+
+@dataclass(frozen=True)
+class CachedSection:
+    id: int
+    name: str
+    capacity: int
+    staff_id: Optional[int]
+    member_ids: FrozenSet[int]
+    staff: Optional[CachedPerson]
+    students: List[CachedPerson]
+    enrollment_code: Optional[str]
+    payload: dict  # the Section.json fields that do not depend on the viewer
+    staff_json: dict  # Section.json exactly as staff see it
+
+    @property
+    def score(self) -> int:
+        spare_capacity = max(0, self.capacity - len(self.member_ids))
+        return self.id - BIG * spare_capacity
+
+    @classmethod
+    def from_section(cls, section: Section) -> CachedSection:
+        staff = CachedPerson.from_user(section.staff) if section.staff is not None else None
+        students = [
+            CachedPerson.from_user(student)
+            for student in sorted(section.students, key=lambda student: student.name)
+        ]
+        payload = {
+            "id": str(section.id),
+            "description": section.description,
+            "capacity": section.capacity,
+            "enrolledCount": len(students),
+            "canSelfEnroll": section.can_self_enroll,
+            "needsEnrollmentCode": section.needs_enrollment_code,
+            "tags": section.tags,
+            "name": section.name,
+            "startTime": section.start_time,
+            "endTime": section.end_time,
+            "location": section.location,
+            "callLink": section.call_link,
+        }
+        return cls(
+            id=section.id,
+            name=section.name,
+            capacity=section.capacity,
+            staff_id=section.staff_id,
+            member_ids=frozenset(student.id for student in students),
+            staff=staff,
+            students=students,
+            enrollment_code=section.enrollment_code,
+            payload=payload,
+            staff_json={
+                **payload,
+                "staff": staff.json if staff is not None else None,
+                "students": [student.json for student in students],
+                "enrollmentCode": section.enrollment_code,
+            },
+        )
+
+    def render(self, viewer: VisibilityContext) -> dict:
+        """
+        Returns the Section.json of this section as seen by the viewer.
+        """
+        if viewer.is_staff:
+            return self.staff_json
+        if viewer.user_id in self.member_ids:
+            students = [_render_person(student, viewer) for student in self.students]
+        else:
+            # students browsing other sections only need enrolledCount
+            students = []
+        return {
+            **self.payload,
+            "staff": _render_person(self.staff, viewer) if self.staff is not None else None,
+            "students": students,
+            "enrollmentCode": None,
+        }
+
+
+def _render_person(person: CachedPerson, viewer: VisibilityContext) -> dict:
+    return person.json if viewer.can_see(person.id, person.is_staff) else anonymous_json()
+
+
+def fingerprint(viewer: VisibilityContext) -> str:
+    # identifies everything besides the sections themselves that rendering depends on
+    visibility = "staff" if viewer.is_staff else ",".join(map(str, sorted(viewer.classmate_ids)))
+    return sha1(f"{viewer.user_id}:{visibility}".encode()).hexdigest()[:16]
+
+
+SortKey = Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class CourseCatalog:
+    course: str
+    version: int
+    sections: Dict[int, CachedSection]
+    student_order: List[Tuple[SortKey, CachedSection]] = field(init=False, repr=False)
+    staff_order: List[Tuple[SortKey, CachedSection]] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        # the ordering only depends on the viewer through OWN_SECTION_BOOST, so
+        # everything else is sorted once per catalog version rather than per request
+        student_order = sorted(
+            ((section.score, section.id), section) for section in self.sections.values()
+        )
+        staff_order = sorted(
+            (
+                (section.score - (UNSTAFFED_BOOST if section.staff_id is None else 0), section.id),
+                section,
+            )
+            for section in self.sections.values()
+        )
+        object.__setattr__(self, "student_order", student_order)
+        object.__setattr__(self, "staff_order", staff_order)
+
+    def ordered_sections(self, viewer: VisibilityContext) -> List[CachedSection]:
+        """
+        Returns every section in the order the viewer should see them: unclaimed
+        ones first for staff, then the viewer's own sections, then the ones with
+        the most spare capacity.
+        """
+        own, rest = [], []
+        for (score, section_id), section in (
+            self.staff_order if viewer.is_staff else self.student_order
+        ):
+            if section.staff_id == viewer.user_id or viewer.user_id in section.member_ids:
+                own.append(((score - OWN_SECTION_BOOST, section_id), section))
+            else:
+                rest.append(((score, section_id), section))
+        return [section for _, section in merge(own, rest)]
+
+    def cursor(self, viewer: VisibilityContext) -> str:
+        return f"{self.version}-{fingerprint(viewer)}"
+
+    def changes_since(self, cursor: str, viewer: VisibilityContext) -> Optional[Set[int]]:
+        """
+        Returns the ids of the sections added, changed or deleted since the
+        client received the given cursor, or None if a full snapshot is needed
+        because the cursor is unknown, belongs to another viewer or predates the
+        last time the whole catalog was invalidated.
+        """
+        version, _, cursor_fingerprint = cursor.partition("-")
+        if not version.isdigit() or cursor_fingerprint != fingerprint(viewer):
+            return None
+        version = int(version)
+        if version > self.version:
+            return None
+        _, floor = log_versions.current(SECTION_LOG, self.course)
+        if version < floor:
+            return None
+        return _changed_section_ids(self.course, version, self.version)
+
+    def viewer(self, user: User) -> VisibilityContext:
+        # the same context VisibilityContext.for_user would build, without a query
+        classmate_ids = set()
+        if not user.is_staff:
+            for section in self.sections.values():
+                if user.id in section.member_ids:
+                    classmate_ids |= section.member_ids
+        return VisibilityContext(
+            user_id=user.id, is_staff=user.is_staff, classmate_ids=frozenset(classmate_ids)
+        )
+
+
+_catalogs: Dict[str, CourseCatalog] = {}
+_lock = Lock()
+
+
+def get_catalog(course: str) -> CourseCatalog:
+    """
+    Returns the catalog of the course, reloading only the sections that
+    changed since this worker last read it.
+    """
+    with _lock:
+        catalog = _catalogs.get(course)
+
+    version, floor = log_versions.current(SECTION_LOG, course)
+    if catalog is not None and catalog.version >= version:
+        return catalog
+    if catalog is None or catalog.version < floor:
+        catalog = _load_catalog(course, version)
+    else:
+        catalog = _patch_catalog(
+            course,
+            catalog,
+            list(_changed_section_ids(course, catalog.version, version)),
+            version,
+        )
+
+    with _lock:
+        current = _catalogs.get(course)
+        if current is None or current.version <= catalog.version:
+            _catalogs[course] = catalog
+    return catalog
+
+
+def _changed_section_ids(course: str, since: int, until: int) -> Set[int]:
+    changes = (
+        db.session.query(SectionChange.section_id)
+        .filter(
+            SectionChange.course == course,
+            SectionChange.version > since,
+            SectionChange.version <= until,
+        )
+        .all()
+    )
+    return {section_id for (section_id,) in changes}
+
+
+def _load_catalog(course: str, version: int) -> CourseCatalog:
+    # the version was read first, so a concurrent write can only make us reload too much
+    sections = Section.query.filter_by(course=course).options(*ROSTER_DETAIL).all()
+    return CourseCatalog(
+        course=course,
+        version=version,
+        sections={section.id: CachedSection.from_section(section) for section in sections},
+    )
+
+
+def _patch_catalog(
+    course: str, catalog: CourseCatalog, section_ids: List[int], version: int
+) -> CourseCatalog:
+    sections = dict(catalog.sections)
+    for section_id in section_ids:
+        sections.pop(section_id, None)
+    for section in (
+        Section.query.filter(Section.course == course, Section.id.in_(section_ids))
+        .options(*ROSTER_DETAIL)
+        .all()
+    ):
+        sections[section.id] = CachedSection.from_section(section)
+    return CourseCatalog(course=course, version=version, sections=sections)
+
+
+def record_change(course: str, section_ids: Optional[Iterable[int]] = None):
+    """
+    Logs a write the flush hook cannot see, such as a bulk Query.delete().
+    Passing no section ids invalidates the whole catalog of the course, and
+    drops the older log entries since no cursor can be diffed past it.
+    """
+    connection = db.session.connection()
+    if section_ids is None:
+        _trim_log(connection, course, log_versions.bump(connection, SECTION_LOG, course))
+    else:
+        _append_changes(connection, course, section_ids)
+
+
+def _append_changes(connection, course: str, section_ids: Iterable[int]):
+    changes = [dict(section_id=section_id) for section_id in section_ids]
+    if not changes:
+        return
+    version = log_versions.bump(connection, SECTION_LOG, course)
+    connection.execute(
+        SectionChange.__table__.insert(),
+        [dict(course=course, version=version, **change) for change in changes],
+    )
+    # past this many versions, a diff costs about as much as reloading the catalog
+    if version % SECTION_LOG_TRIM_INTERVAL == 0 and version > SECTION_LOG_RETENTION:
+        _trim_log(connection, course, version - SECTION_LOG_RETENTION)
+
+
+def _trim_log(connection, course: str, floor: int):
+    # cursors older than the floor get a full snapshot
+    connection.execute(
+        SectionChange.__table__.delete().where(
+            and_(SectionChange.course == course, SectionChange.version <= floor)
+        )
+    )
+    log_versions.raise_floor(connection, SECTION_LOG, course, floor)
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _record_section_changes(session: OrmSession, flush_context):
+    # (course, section_id) pairs, a deleted section is told apart by its absence
+    changed = set()
+    new, dirty, deleted = session.new, session.dirty, session.deleted
+
+    for obj in chain(new, dirty, deleted):
+        if isinstance(obj, Section):
+            if obj in deleted or obj in new or session.is_modified(obj):
+                changed.add((obj.course, obj.id))
+        elif isinstance(obj, User):
+            for key in ("sections", "sections_taught"):
+                # an unloaded collection holds no changes, and loading it would
+                # cost a query per flushed user
+                history = attributes.get_history(
+                    obj, key, passive=attributes.PASSIVE_NO_INITIALIZE
+                )
+                for section in chain(history.added or (), history.deleted or ()):
+                    changed.add((section.course, section.id))
+            if obj in dirty and any(
+                attributes.get_history(obj, key).has_changes() for key in USER_JSON_COLUMNS
+            ):
+                # the user is rendered inside every section they belong to or teach
+                connection = session.connection()
+                for (section_id,) in connection.execute(
+                    select([user_section.c.section_id]).where(user_section.c.user_id == obj.id)
+                ):
+                    changed.add((obj.course, section_id))
+                for (section_id,) in connection.execute(
+                    select([Section.id]).where(Section.staff_id == obj.id)
+                ):
+                    changed.add((obj.course, section_id))
+
+    by_course: Dict[str, List[int]] = {}
+    for course, section_id in changed:
+        by_course.setdefault(course, []).append(section_id)
+    for course, section_ids in by_course.items():
+        _append_changes(session.connection(), course, section_ids)
@@ -10,24 +10,32 @@ import csv
 import argparse
 
 from main import app
-from import_sheet import import_enrollment, import_sections
+from import_sheet import IMPORT_CHUNK_SIZE, import_enrollment, import_sections
+
+def main(import_type, file_path: str, chunk_size: int, atomic: bool, dry_run: bool):
+    def progress(done, total=None):
+        print(f"Imported {done} rows")
 
-def main(import_type, file_path: str):
     with app.app_context():
         with open(file_path, mode='r') as f:
             csvData = csv.reader(f)
 
             if import_type == "sections":
-                import_sections(csvData)
+                errors = import_sections(csvData, chunk_size=chunk_size, atomic=atomic, dry_run=dry_run, progress=progress)
             elif import_type == "enrollment":
-                import_enrollment(csvData)
+                errors = import_enrollment(csvData, chunk_size=chunk_size, atomic=atomic, dry_run=dry_run, progress=progress)
 
-    print("Done importing!")
+    for error in errors:
+        print(f"Invalid {error}" if dry_run else f"Skipped {error}")
+    print("Done validating!" if dry_run else "Done importing!")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--type", required=True, type=str, choices=["sections", "enrollment"])
     parser.add_argument("--file", required=True, type=str)
+    parser.add_argument("--chunk-size", default=IMPORT_CHUNK_SIZE, type=int)
+    parser.add_argument("--dry-run", action="store_true", help="only report the rows that would fail to import")
+    parser.add_argument("--commit-chunks", action="store_true", help="commit each chunk and skip invalid rows instead of importing all or nothing")
     
     args = parser.parse_args()
-    main(args.type, args.file)
\ No newline at end of file
+    main(args.type, args.file, args.chunk_size, not args.commit_chunks, args.dry_run)
\ No newline at end of file
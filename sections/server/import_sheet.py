@@ -1,23 +1,37 @@
 from __future__ import annotations
 
+import re
 from datetime import datetime
-from typing import List, Iterator
+from functools import lru_cache
+from itertools import chain, islice
+from typing import List, Iterator, Optional
 
 from zoneinfo import ZoneInfo
 
+from sqlalchemy import and_, bindparam, select
+
 from common.course_config import get_course
 from common.rpc.auth import read_spreadsheet
 from dataclasses import asdict, dataclass, field, fields
 from models import Failure, Section, User, db, user_section
+import catalog
 
 # Sample Spreadsheet Link: https://docs.google.com/spreadsheets/d/1WL7gXiBxPe6aUFBKfEOVS6iY27ITy9mARupLoJX-ouE/edit?usp=sharing
 pst = ZoneInfo("US/Pacific")
+IMPORT_CHUNK_SIZE = 500  # rows written, and committed unless atomic, at a time
+DAYS = ["M", "T", "W", "Th", "F"]
+TIME_STRING = re.compile(r"(0\d|1[0-2]):[0-5]\d[ap]")  # e.g. 08:00a or 12:30p
+SLOT_MINUTES = 5  # granularity of the precomputed (day, time) <-> timestamp tables
 
 
-def parse_time_string(day, time):
+def _time_string(hour: int, minute: int, ampm: str) -> str:
+    return f"{hour:02}:{minute:02}{ampm}"
+
+
+def _parse_time_string(day, time):
     hour, min, ampm = int(time[0:2]), int(time[3:5]), time[5]
 
-    day_offset = ["M", "T", "W", "Th", "F"].index(day)
+    day_offset = DAYS.index(day)
     hour_offset = 12 if hour != 12 and ampm == "p" else 0
 
     return datetime(
@@ -30,6 +44,74 @@ def parse_time_string(day, time):
     ).timestamp()
 
 
+def _format_timestamp(timestamp):
+    dt = datetime.fromtimestamp(timestamp, tz=pst)
+    day = DAYS[dt.weekday()] if dt.weekday() < len(DAYS) else ""
+    return day, dt.strftime("%I:%M%p").lower().replace("m", "")
+
+
+# every time string a sheet can hold on the SLOT_MINUTES grid, e.g. ("M", "08:00a")
+_TIMESTAMPS = {
+    (day, _time_string(hour, minute, ampm)): _parse_time_string(
+        day, _time_string(hour, minute, ampm)
+    )
+    for day in DAYS
+    for hour in range(13)
+    for minute in range(0, 60, SLOT_MINUTES)
+    for ampm in "ap"
+}
+# the reverse, for every slot of the week parse_time_string lands in. Sheets
+# read 12:xxa as noon, so times between midnight and 1am do not round-trip.
+_TIME_STRINGS = {
+    midnight + offset: _format_timestamp(midnight + offset)
+    for midnight in (_TIMESTAMPS[day, "00:00a"] for day in DAYS)
+    for offset in range(0, 24 * 60 * 60, SLOT_MINUTES * 60)
+}
+
+
+@lru_cache(maxsize=1024)  # for times off the grid, e.g. 08:07a
+def _parse_off_grid(day, time):
+    return _parse_time_string(day, time)
+
+
+def _normalize_time_string(day, time):
+    # sheet cells may hold stray whitespace, capitals or a trailing m, e.g. "08:00PM "
+    time = time.strip().lower()
+    return day.strip(), time[:-1] if time.endswith("m") else time
+
+
+def parse_time_string(day, time):
+    """
+    Returns the timestamp a day code and time from a sheet stand for, e.g.
+    ("M", "08:00a"), during the week every section time is stored in.
+    """
+    day, time = _normalize_time_string(day, time)
+    timestamp = _TIMESTAMPS.get((day, time))
+    return timestamp if timestamp is not None else _parse_off_grid(day, time)
+
+
+def format_timestamp(timestamp):
+    """
+    Returns the day code and time a section timestamp is shown as in sheets,
+    e.g. ("M", "08:00a"), or an empty day code for weekends.
+    """
+    time_strings = _TIME_STRINGS.get(timestamp)
+    return time_strings if time_strings is not None else _format_timestamp(timestamp)
+
+
+def check_time_string(day, time) -> Optional[str]:
+    """
+    Returns what would make parse_time_string fail on the given day code and
+    time, if anything.
+    """
+    day, time = _normalize_time_string(day, time)
+    if day not in DAYS:
+        return f"unknown day {day!r}, expected one of {', '.join(DAYS)}"
+    if not TIME_STRING.fullmatch(time):
+        return f"invalid time {time!r}, expected a time like 08:00a"
+    return None
+
+
 def header_field(col_name: str):
     return field(default=None, metadata=dict(col_name=col_name))
 
@@ -81,30 +163,100 @@ def process_header(model, header: List):
     return model
 
 
-def import_sections(data: Iterator):
+def run_import(
+    data: Iterator, import_chunk, chunk_size: int, atomic: bool, dry_run: bool, progress=None
+) -> List[str]:
+    """
+    Feeds the rows after the header to import_chunk, chunk_size rows at a time,
+    so only one chunk is held in memory.
+
+    In atomic mode nothing is committed unless every row imports, and all errors
+    are raised together. Otherwise each chunk is committed once its valid rows
+    are written, and the errors of the rows that were skipped are returned.
+    A dry run only validates the rows, and returns the errors of every row that
+    would have been skipped.
+    """
+    errors = []
+    line = 2  # the header is line 1 of the sheet
+    while True:
+        rows = list(islice(data, chunk_size))
+        if not rows:
+            break
+        errors += import_chunk(rows, line)
+        line += len(rows)
+        if not atomic and not dry_run:
+            db.session.commit()
+        if progress is not None:
+            progress(line - 2)
+
+    if dry_run:
+        db.session.rollback()
+    elif atomic:
+        if errors:
+            db.session.rollback()
+            raise Failure("\n".join(errors))
+        db.session.commit()
+    return errors
+
+
+def import_sections(
+    data: Iterator,
+    course: str = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    atomic: bool = True,
+    dry_run: bool = False,
+    progress=None,
+) -> List[str]:
     model = SectionsHeader()
     header = process_header(model, next(data))
+    course = course or get_course()
+
+    def import_chunk(rows, line):
+        return import_sections_chunk(rows, line, header, course, dry_run)
+
+    return run_import(data, import_chunk, chunk_size, atomic, dry_run, progress)
+
+
+def check_sections_row(row: List, header: SectionsHeader) -> Optional[str]:
+    can_self_enroll = row[header.self_enroll_index].lower()
+    if can_self_enroll not in ("false", "true"):
+        return f"unknown boolean value: {can_self_enroll}"
+    capacity = row[header.capacity_index]
+    if not capacity.isdigit():
+        return f"invalid capacity {capacity!r}"
+    return check_time_string(
+        row[header.day_index], row[header.start_index]
+    ) or check_time_string(row[header.day_index], row[header.end_index])
+
+
+def import_sections_chunk(
+    rows: List, line: int, header: SectionsHeader, course: str, dry_run: bool
+) -> List[str]:
+    staff_ids = {
+        email: staff_id
+        for email, staff_id in db.session.query(User.email, User.id).filter(
+            User.course == course,
+            User.email.in_({row[header.email_index] for row in rows}),
+        )
+    }
+    new_staff = {}  # email -> name, for staff without a User yet
+
+    errors = []
+    new_sections = []
+    for line, row in enumerate(rows, start=line):
+        error = check_sections_row(row, header)
+        if error is not None:
+            errors.append(f"Row {line}: {error}")
+            continue
 
-    for row in data:
         email = row[header.email_index]
         name = row[header.name_index]
         capacity = row[header.capacity_index]
         tags = row[header.tags_index]
-        can_self_enroll = row[header.self_enroll_index].lower()
-        if can_self_enroll not in ("false", "true"):
-            raise Failure(f"Unknown boolean value: {can_self_enroll}")
-        can_self_enroll = can_self_enroll == "true"
-
-        staff = User.query.filter_by(
-            email=email,
-            course=get_course(),
-        ).one_or_none() or User(
-            email=email,
-            name=name,
-            is_staff=True,
-            is_admin=False,
-            course=get_course(),
-        )
+        can_self_enroll = row[header.self_enroll_index].lower() == "true"
+
+        if email not in staff_ids:
+            new_staff.setdefault(email, name)
 
         section_type = row[header.type_index]
         location = row[header.location_index]
@@ -112,44 +264,118 @@ def import_sections(data: Iterator):
                     row[header.day_index], row[header.start_index])
         end_time=parse_time_string(row[header.day_index], row[header.end_index])
 
-        section = Section(
+        new_sections.append(dict(
+            staff_email=email,
             capacity=capacity,
             can_self_enroll=can_self_enroll,
-            staff=staff,
-            course=get_course(),
+            course=course,
             name = section_type, # In models.py, name refers to the type of section (Lab/Discussion/Custom)
             start_time = start_time,
             end_time = end_time,
-            location = location
+            location = location,
+            tag_string = tags,
+        ))
+
+    if dry_run:
+        return errors
+    if new_staff:
+        db.session.bulk_insert_mappings(
+            User,
+            [
+                dict(email=email, name=name, is_staff=True, is_admin=False, course=course)
+                for email, name in new_staff.items()
+            ],
         )
-
-        section.tags = tags.split(",")
-
-        db.session.add(section)
-
-    db.session.commit()
-
-
-def import_sections_from_url(url: str):
+        staff_ids.update(
+            db.session.query(User.email, User.id).filter(
+                User.course == course, User.email.in_(new_staff)
+            )
+        )
+    db.session.bulk_insert_mappings(
+        Section,
+        [
+            dict(section, staff_id=staff_ids[section.pop("staff_email")])
+            for section in new_sections
+        ],
+    )
+    # bulk inserts bypass the flush hook that keeps the section catalog current
+    catalog.record_change(course)
+    return errors
+
+
+def read_sheet(url: str, sheet_name: str) -> List:
     try:
-        reader = read_spreadsheet(
+        return read_spreadsheet(
             url=url,
-            sheet_name=f"Sections",
+            sheet_name=sheet_name,
             course="cs61a",
         )
     except Exception:
         raise Failure(
-            "Unable to read spreadsheet. Make sure to put your data in a sheet named 'Sections'"
+            f"Unable to read spreadsheet. Make sure to put your data in a sheet named '{sheet_name}'"
         )
 
-    import_sections(iter(reader))
-
 
-def import_enrollment(data: Iterator):
+def import_sections_from_url(
+    url: str, course: str = None, atomic: bool = True, dry_run: bool = False, progress=None
+) -> List[str]:
+    reader = read_sheet(url, "Sections")
+    if progress is not None:
+        progress(0, len(reader) - 1)
+    return import_sections(
+        iter(reader), course=course, atomic=atomic, dry_run=dry_run, progress=progress
+    )
+
+
+def import_enrollment(
+    data: Iterator,
+    course: str = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    atomic: bool = True,
+    dry_run: bool = False,
+    progress=None,
+) -> List[str]:
     model = EnrollmentHeader()
     header = process_header(model, next(data))
+    course = course or get_course()
+
+    # Assumes that each section can be uniquely identified by the below parameters
+    section_ids = {
+        (staff_id, name, start_time, location): section_id
+        for section_id, staff_id, name, start_time, location in db.session.query(
+            Section.id, Section.staff_id, Section.name, Section.start_time, Section.location
+        ).filter(Section.course == course)
+    }
+
+    def import_chunk(rows, line):
+        return import_enrollment_chunk(rows, line, header, course, section_ids, dry_run)
+
+    return run_import(data, import_chunk, chunk_size, atomic, dry_run, progress)
+
+
+def import_enrollment_chunk(
+    rows: List, line: int, header: EnrollmentHeader, course: str, section_ids: dict, dry_run: bool
+) -> List[str]:
+    emails = set()
+    for row in rows:
+        emails.add(row[header.student_email_index])
+        emails.add(row[header.staff_email_index])
+    user_ids = {
+        email: user_id
+        for email, user_id in db.session.query(User.email, User.id).filter(
+            User.course == course, User.email.in_(emails)
+        )
+    }
+
+    errors = []
+    new_students = {}  # email -> name, for students without a User yet
+    targets = {}  # (student email, section type) -> section id, later rows win
+    for line, row in enumerate(rows, start=line):
+        error = check_time_string(row[header.day_index], row[header.start_index])
+        if error is not None:
+            errors.append(f"Row {line}: {error}")
+            continue
 
-    for row in data:
         student_email = row[header.student_email_index]
         student_name = row[header.student_name_index]
         staff_email = row[header.staff_email_index]
@@ -157,54 +383,83 @@ def import_enrollment(data: Iterator):
         start_time = parse_time_string(row[header.day_index], row[header.start_index])
         section_type = row[header.type_index]
 
-        student = User.query.filter_by(
-            email=student_email,
-            course=get_course()
-        ).one_or_none() or User(
-            email=student_email,
-            name=student_name,
-            is_staff=False,
-            is_admin=False,
-            course=get_course()
+        if staff_email not in user_ids:
+            errors.append(f"Row {line}: unknown staff member {staff_email} for {student_email}")
+            continue
+        section_id = section_ids.get(
+            (user_ids[staff_email], section_type, start_time, location)
         )
-
-        staff = User.query.filter_by(
-            email=staff_email,
-            course=get_course(),
-        ).one()
-
-        # Assumes that each section can be uniquely identified by the below parameters
-        section = Section.query.filter_by(
-            staff=staff,
-            course=get_course(),
-            name=section_type,
-            start_time=start_time,
-            location=location
-        ).one_or_none()
-
-        if section is None:
-            raise Failure(f"Unable to import enrollment data for {student_email}! Trying to enroll in {staff_email} | {location} | {start_time} | {section_type}")
-
-        # If user is already in a section of the same type, remove it and add target section
-        for s in student.sections:
-            if s.name == section.name:
-                student.sections.remove(s)
-                break
-        student.sections.append(section)
-
-    db.session.commit()
-
-
-def import_enrollment_from_url(url: str):
-    try:
-        reader = read_spreadsheet(
-            url=url,
-            sheet_name=f"Enrollment",
-            course="cs61a",
+        if section_id is None:
+            errors.append(f"Row {line}: unable to import enrollment data for {student_email}! Trying to enroll in {staff_email} | {location} | {start_time} | {section_type}")
+            continue
+
+        if student_email not in user_ids:
+            new_students.setdefault(student_email, student_name)
+        targets[(student_email, section_type)] = section_id
+
+    if dry_run:
+        return errors
+    if new_students:
+        db.session.bulk_insert_mappings(
+            User,
+            [
+                dict(email=email, name=name, is_staff=False, is_admin=False, course=course)
+                for email, name in new_students.items()
+            ],
         )
-    except Exception:
-        raise Failure(
-            "Unable to read spreadsheet. Make sure to put your data in a sheet named 'Enrollment'"
+        user_ids.update(
+            db.session.query(User.email, User.id).filter(
+                User.course == course, User.email.in_(new_students)
+            )
         )
 
-    import_enrollment(iter(reader))
\ No newline at end of file
+    # If user is already in a section of the same type, remove it and add target section
+    targets = {
+        (user_ids[email], section_type): section_id
+        for (email, section_type), section_id in targets.items()
+    }
+    current = db.session.execute(
+        select([user_section.c.user_id, user_section.c.section_id, Section.name])
+        .select_from(user_section.join(Section))
+        .where(user_section.c.user_id.in_({user_id for user_id, _ in targets}))
+    )
+    removed = []
+    for user_id, section_id, section_type in current:
+        target = targets.get((user_id, section_type))
+        if target == section_id:
+            del targets[(user_id, section_type)]  # already enrolled
+        elif target is not None:
+            removed.append(dict(user_id=user_id, section_id=section_id))
+    added = [
+        dict(user_id=user_id, section_id=section_id)
+        for (user_id, _), section_id in targets.items()
+    ]
+
+    if removed:
+        db.session.execute(
+            user_section.delete().where(
+                and_(
+                    user_section.c.user_id == bindparam("user_id"),
+                    user_section.c.section_id == bindparam("section_id"),
+                )
+            ),
+            removed,
+        )
+    if added:
+        db.session.execute(user_section.insert(), added)
+    # bulk writes bypass the flush hook that keeps the section catalog current
+    catalog.record_change(
+        course, {change["section_id"] for change in chain(removed, added)}
+    )
+    return errors
+
+
+def import_enrollment_from_url(
+    url: str, course: str = None, atomic: bool = True, dry_run: bool = False, progress=None
+) -> List[str]:
+    reader = read_sheet(url, "Enrollment")
+    if progress is not None:
+        progress(0, len(reader) - 1)
+    return import_enrollment(
+        iter(reader), course=course, atomic=atomic, dry_run=dry_run, progress=progress
+    )
@@ -0,0 +1,255 @@
+"""
+Runs long admin operations, such as sheet imports, outside the request that
+started them.
+
+Requests enqueue a Job row naming a registered handler and its arguments.
+Worker threads in every server process claim queued jobs from the database,
+so no broker is needed and a job survives the request that created it. Each
+job reports its progress and result to its row, which clients poll through
+the fetch_job endpoint.
+
+A claimed job is leased to its worker, which keeps extending the lease while
+the job runs. If the process dies mid-job, the lease lapses, and another
+worker claims the job again if its handler is safe to rerun from the start,
+up to MAX_ATTEMPTS times, or fails it otherwise. SQLite jobs cannot extend
+their lease, so there leases never lapse and a dead process leaves its job
+running.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional, Set
+
+from flask import current_app
+from flask_login import current_user
+from sqlalchemy import and_, or_, select
+
+from common.course_config import get_course
+from models import Failure, Job, JobStatus, db
+
+WORKERS = int(os.getenv("JOB_WORKERS", 1))  # per server process
+POLL_INTERVAL = 2  # seconds between checks for jobs enqueued by other processes
+RETENTION = 60 * 60 * 24 * 7  # seconds finished jobs and their results are kept
+LEASE = 5 * 60  # seconds a running job is reserved for its worker without a heartbeat
+HEARTBEAT_INTERVAL = LEASE / 5  # seconds between extensions of a running job's lease
+MAX_ATTEMPTS = 3  # claims of a job before it is failed rather than run again
+
+# called with the number of rows done so far, and the total once it is known
+Progress = Callable[..., None]
+
+
+@dataclass
+class JobResult:
+    message: Optional[str] = None  # shown to the admin who started the job
+    payload: Optional[dict] = None  # e.g. the file an export produced
+
+
+# called with the job's course, a Progress callback and the job's arguments
+Handler = Callable[..., Optional[JobResult]]
+
+_handlers: Dict[str, Handler] = {}
+_retryable: Set[str] = set()  # kinds whose handlers are safe to rerun from the start
+_wakeup = Event()
+_workers_lock = Lock()
+_workers: List[Thread] = []
+
+
+def handler(kind: str, retryable: bool = False):
+    """
+    Registers the function running jobs of the given kind. It runs inside an
+    app context but outside of any request, so get_course() is unavailable
+    and the course is passed in instead. Only retryable handlers are run
+    again when their worker dies mid-job, so they must not leave partial
+    writes behind, e.g. by committing once at the end.
+    """
+
+    def register(func: Handler) -> Handler:
+        _handlers[kind] = func
+        if retryable:
+            _retryable.add(kind)
+        return func
+
+    return register
+
+
+def enqueue(kind: str, **args) -> Job:
+    """
+    Queues a job for the current course, on behalf of the current user. The
+    arguments must be JSON-serializable.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for {kind} jobs")
+    job = Job(
+        course=get_course(),
+        kind=kind,
+        args=json.dumps(args),
+        status=JobStatus.queued,
+        created_at=int(time.time()),
+        created_by=current_user.id if current_user.is_authenticated else None,
+    )
+    db.session.add(job)
+    db.session.commit()
+    start_workers(current_app._get_current_object())
+    _wakeup.set()
+    return job
+
+
+def start_workers(app):
+    """
+    Starts this process's worker threads, replacing any that died. Each server
+    process runs its own, which also pick up jobs left behind when a process
+    went away.
+    """
+    with _workers_lock:
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        while len(_workers) < WORKERS:
+            worker = Thread(target=_work, args=(app,), daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _update(job_id: int, **values):
+    return Job.__table__.update().where(Job.__table__.c.id == job_id).values(**values)
+
+
+def report(job_id: int, **values):
+    # written on its own connection, so progress shows up while the job's
+    # transaction is still open, e.g. during an all-or-nothing import
+    with db.engine.begin() as connection:
+        connection.execute(_update(job_id, **values))
+
+
+def _claim() -> Optional[int]:
+    job = Job.__table__
+    with db.engine.begin() as connection:
+        while True:
+            now = int(time.time())
+            claimable = job.c.status == JobStatus.queued
+            if connection.dialect.name != "sqlite":
+                # or jobs whose worker stopped extending their lease
+                claimable = or_(
+                    claimable,
+                    and_(job.c.status == JobStatus.running, job.c.leased_until < now),
+                )
+            row = connection.execute(
+                select([job.c.id, job.c.kind, job.c.status, job.c.attempts])
+                .where(claimable)
+                .order_by(job.c.id)
+                .limit(1)
+            ).first()
+            if row is None:
+                return None
+            if row.status == JobStatus.running and (
+                row.kind not in _retryable or row.attempts >= MAX_ATTEMPTS
+            ):
+                connection.execute(
+                    job.update()
+                    .where(and_(job.c.id == row.id, claimable))
+                    .values(
+                        status=JobStatus.failed,
+                        message="The job was interrupted too many times."
+                        if row.kind in _retryable
+                        else "The job was interrupted, check what it changed before rerunning it.",
+                    )
+                )
+                continue
+            # another worker, possibly in another process, may have claimed it first
+            claimed = connection.execute(
+                job.update()
+                .where(and_(job.c.id == row.id, claimable))
+                .values(
+                    status=JobStatus.running,
+                    leased_until=now + LEASE,
+                    attempts=job.c.attempts + 1,
+                )
+            ).rowcount
+            if claimed:
+                return row.id
+
+
+def _delete_expired():
+    job = Job.__table__
+    with db.engine.begin() as connection:
+        connection.execute(
+            job.delete().where(
+                and_(
+                    job.c.status.in_([JobStatus.succeeded, JobStatus.failed]),
+                    job.c.created_at < int(time.time()) - RETENTION,
+                )
+            )
+        )
+
+
+def _work(app):
+    with app.app_context():
+        while True:
+            try:
+                _delete_expired()
+                job_id = _claim()
+            except Exception:
+                logging.exception("Unable to claim a job")
+                job_id = None
+            if job_id is None:
+                _wakeup.wait(POLL_INTERVAL)
+                _wakeup.clear()
+                continue
+            try:
+                _run(app, job_id)
+            except Exception:
+                # e.g. the database went away while reporting, the lease lets
+                # another claim retry the job
+                logging.exception("Unable to run job %s", job_id)
+
+
+def _heartbeat(app, job_id: int, stopped: Event):
+    with app.app_context():
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                report(job_id, leased_until=int(time.time()) + LEASE)
+            except Exception:
+                logging.exception("Unable to extend the lease of job %s", job_id)
+
+
+def _run(app, job_id: int):
+    job = Job.query.get(job_id)
+    stopped = Event()
+
+    def progress(done: int, total: Optional[int] = None):
+        values = dict(done=done) if total is None else dict(done=done, total=total)
+        if db.engine.dialect.name == "sqlite":
+            # SQLite allows a single writer, which may be the job's open
+            # transaction, so progress shows once the job commits
+            db.session.execute(_update(job_id, **values))
+        else:
+            report(job_id, **values)
+
+    if db.engine.dialect.name != "sqlite":
+        # for the same reason, SQLite jobs cannot extend their lease, and
+        # _claim never takes them back
+        Thread(target=_heartbeat, args=(app, job_id, stopped), daemon=True).start()
+    try:
+        result = _handlers[job.kind](job.course, progress, **json.loads(job.args)) or JobResult()
+    except Failure as failure:
+        db.session.rollback()
+        report(job_id, status=JobStatus.failed, message=str(failure))
+    except Exception:
+        logging.exception("Job %s failed", job_id)
+        db.session.rollback()
+        report(job_id, status=JobStatus.failed, message="Something went wrong.")
+    else:
+        db.session.commit()  # including any progress written through the session
+        report(
+            job_id,
+            status=JobStatus.succeeded,
+            message=result.message,
+            result=json.dumps(result.payload) if result.payload is not None else None,
+        )
+    finally:
+        stopped.set()
+        db.session.remove()
@@ -0,0 +1,70 @@
+"""
+Commit-ordered versions of the append-only change logs, such as the
+SectionChange log behind the catalog.
+
+An autoincrement id is assigned when a row is flushed, not when its
+transaction commits, so a reader could see id 11 before id 10 commits and
+skip past it for good. Instead, every transaction appending to a log first
+bumps the LogVersion row of that log and course, which stays locked until the
+transaction ends. A version therefore only becomes visible once every lower
+one has committed, and readers can safely remember the highest they saw.
+"""
+
+from __future__ import annotations
+
+from typing import Tuple
+
+from sqlalchemy import and_, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from models import LogVersion, db
+
+log_version = LogVersion.__table__
+
+
+def _row(log: str, course: str):
+    return and_(log_version.c.log == log, log_version.c.course == course)
+
+
+def bump(connection, log: str, course: str) -> int:
+    """
+    Returns a new version of the log for the current transaction, holding the
+    lock on it until the transaction commits or rolls back.
+    """
+    if connection.dialect.name == "mysql":
+        statement = mysql_insert(log_version).values(log=log, course=course, version=1, floor=0)
+        connection.execute(
+            statement.on_duplicate_key_update(version=log_version.c.version + 1)
+        )
+    elif not connection.execute(
+        log_version.update()
+        .where(_row(log, course))
+        .values(version=log_version.c.version + 1)
+    ).rowcount:
+        connection.execute(
+            log_version.insert().values(log=log, course=course, version=1, floor=0)
+        )
+    return connection.execute(
+        select([log_version.c.version]).where(_row(log, course))
+    ).scalar()
+
+
+def raise_floor(connection, log: str, course: str, floor: int):
+    """
+    Records that the log no longer holds the changes up to the given version.
+    """
+    connection.execute(
+        log_version.update()
+        .where(and_(_row(log, course), log_version.c.floor < floor))
+        .values(floor=floor)
+    )
+
+
+def current(log: str, course: str) -> Tuple[int, int]:
+    """
+    Returns the latest committed version of the log and its floor.
+    """
+    row = db.session.execute(
+        select([log_version.c.version, log_version.c.floor]).where(_row(log, course))
+    ).first()
+    return (row.version, row.floor) if row is not None else (0, 0)
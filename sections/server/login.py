@@ -3,7 +3,6 @@ from os import getenv
 import flask
 from flask import redirect, session
 from flask_login import LoginManager, login_user, logout_user
-import canvasapi
 
 from common.course_config import get_course, get_endpoint, get_bcourses_id
 from common.oauth_client import create_oauth_client, get_user, is_staff
@@ -22,11 +21,9 @@ def create_login_client(app: flask.Flask):
     def login(resp: dict):
         user_info = resp['user']
         user_id = user_info['id']
-        canvas_user = canvas_service.get_user(user_id)
-        user_email = canvas_service.get_email(user_id)
-        user_name = canvas_service.get_name(user_id)
-        user_courses = canvas_service.get_user_courses(user_id)
-        app_course_id: int = get_bcourses_id()
+        info = canvas_service.get_login_info(user_id, get_bcourses_id())
+        user_email = info.email
+        user_name = info.name
         course = get_course()
 
         user = User.query.filter_by(
@@ -42,17 +39,8 @@ def create_login_client(app: flask.Flask):
             )
             db.session.add(user)
         user.name = user_name or user_email
-
-        try:
-            app_course = canvas_service.get_course(app_course_id)
-            user.is_staff = canvas_service.is_staff(app_course, user_id)
-            user.is_admin = canvas_service.is_admin(app_course, user_id)
-        except canvasapi.exceptions.Forbidden as e:
-            if 1549197 in [c.id for c in user_courses]:
-                user.is_staff = True
-                user.is_admin = True
-            else:
-                raise e
+        user.is_staff = info.is_staff
+        user.is_admin = info.is_admin
         db.session.commit()
         login_user(user, remember=True)
 
@@ -1,12 +1,24 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
 from enum import Enum
 from random import randrange
-from typing import List
+from typing import Dict, FrozenSet, List
 from urllib.parse import quote
 
 import flask
+from flask import g, has_app_context
 from flask_login import UserMixin, current_user
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import joinedload
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import (
+    Session as OrmSession,
+    configure_mappers,
+    contains_eager,
+    joinedload,
+    selectinload,
+)
 
 from common.course_config import get_course_id
 from common.db import database_url
@@ -22,7 +34,9 @@ db = SQLAlchemy()
 # Association Table for User - Section Pairs because each user can have multiple sections
 user_section = db.Table('user_section',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('section_id', db.Integer, db.ForeignKey('section.id'), primary_key=True)
+    db.Column('section_id', db.Integer, db.ForeignKey('section.id'), primary_key=True),
+    # the primary key only serves lookups by user, rosters are looked up by section
+    db.Index('ix_user_section_section_id', 'section_id'),
 )
 
 
@@ -36,14 +50,13 @@ class Section(db.Model):
     staff_id: int = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
     staff: "User" = db.relationship(
         "User",
-        backref=db.backref("sections_taught", lazy="joined"),
-        lazy="joined",
+        backref=db.backref("sections_taught"),
         foreign_keys=[staff_id],
     )
     tag_string: str = db.Column(
         db.String(255), nullable=False, default=""
     )  # comma separated list of tags
-    students: List["User"] = db.relationship('User', secondary=user_section, back_populates='sections', lazy='joined')
+    students: List["User"] = db.relationship('User', secondary=user_section, back_populates='sections')
     # moved attributes from slots to section for decoupling
     name: str = db.Column(db.String(255)) # indicates section type e.g. lab or discussion
     start_time: int = db.Column(db.Integer)
@@ -73,6 +86,7 @@ class Section(db.Model):
                 student.json
                 for student in sorted(self.students, key=lambda student: student.name)
             ],
+            "enrolledCount": len(self.students),
             "description": self.description,
             "capacity": self.capacity,
             "canSelfEnroll": self.can_self_enroll,
@@ -101,7 +115,79 @@ class Section(db.Model):
         }
 
 
+class LogVersion(db.Model):
+    # latest version of a course's change log, bumped by every transaction appending
+    # to it and locked until that commits, so versions become visible in commit order
+    log: str = db.Column(db.String(32), primary_key=True)  # e.g. "section"
+    course: str = db.Column(db.String(255), primary_key=True)
+    version: int = db.Column(db.Integer, nullable=False, default=0)
+    # the log holds every change after this version, older cursors need a snapshot
+    floor: int = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SectionChange(db.Model):
+    # append-only log of section writes, read by catalog version
+    __table_args__ = (
+        # workers read the changes of one course past the version they hold
+        db.Index("ix_section_change_course_version", "course", "version"),
+    )
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    course: str = db.Column(db.String(255))
+    version: int = db.Column(db.Integer)  # the LogVersion of the transaction that wrote it
+    section_id: int = db.Column(db.Integer)
+
+
+class JobStatus(Enum):
+    queued = 1
+    running = 2
+    succeeded = 3
+    failed = 4
+
+
+class Job(db.Model):
+    # an admin operation queued by a request and run by a worker, which clients poll
+    __table_args__ = (
+        # workers claim the oldest queued job, or a running one whose lease lapsed
+        db.Index("ix_job_status_id", "status", "id"),
+    )
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    course: str = db.Column(db.String(255), index=True)
+    kind: str = db.Column(db.String(255))  # names the handler in jobs.py
+    args: str = db.Column(db.Text, default="{}")  # JSON keyword arguments of the handler
+    status: JobStatus = db.Column(db.Enum(JobStatus), default=JobStatus.queued)
+    created_at: int = db.Column(db.Integer)
+    # the User who enqueued it, who may poll it along with admins
+    created_by: int = db.Column(db.Integer, nullable=True)
+    # while running, the time after which another worker may claim it again
+    leased_until: int = db.Column(db.Integer, nullable=True)
+    attempts: int = db.Column(db.Integer, default=0)  # times a worker claimed it
+    done: int = db.Column(db.Integer, default=0)  # rows processed so far
+    total: int = db.Column(db.Integer, nullable=True)  # None until known
+    message: str = db.Column(db.Text, nullable=True)  # outcome, e.g. rows that were skipped
+    # JSON payload, e.g. an exported file, which can outgrow MySQL's 64KB TEXT
+    result: str = db.Column(db.Text(2 ** 32 - 1), nullable=True)
+
+    @property
+    def json(self):
+        return {
+            "id": str(self.id),
+            "kind": self.kind,
+            "status": self.status.name,
+            "done": self.done,
+            "total": self.total,
+            "message": self.message,
+            "result": json.loads(self.result) if self.result is not None else None,
+        }
+
+
 class Session(db.Model):
+    __table_args__ = (
+        # start_session looks sessions up by both, and must not create duplicates
+        db.UniqueConstraint("section_id", "start_time", name="uq_session_section_id_start_time"),
+    )
+
     id: int = db.Column(db.Integer, primary_key=True)
     course: str = db.Column(db.String(255), index=True)
     start_time: int = db.Column(db.Integer)
@@ -133,7 +219,28 @@ class AttendanceStatus(Enum):
     absent = 3
 
 
+class AttendanceChange(db.Model):
+    # append-only log of attendance writes, its version is the cursor of incremental exports
+    __table_args__ = (
+        # exports read the entries of one course past a cursor
+        db.Index("ix_attendance_change_course_version", "course", "version"),
+    )
+
+    id: int = db.Column(db.Integer, primary_key=True)
+    course: str = db.Column(db.String(255))
+    version: int = db.Column(db.Integer)  # the LogVersion of the transaction that wrote it
+    session_id: int = db.Column(db.Integer)
+    student_id: int = db.Column(db.Integer)
+
+
 class Attendance(db.Model):
+    __table_args__ = (
+        # serves a student's attendance history, which joins to session for start_time
+        db.Index("ix_attendance_student_id_session_id", "student_id", "session_id"),
+        # set_attendance keeps at most one record per student and session
+        db.UniqueConstraint("session_id", "student_id", name="uq_attendance_session_id_student_id"),
+    )
+
     id: int = db.Column(db.Integer, primary_key=True)
     course: str = db.Column(db.String(255), index=True)
     status: AttendanceStatus = db.Column(db.Enum(AttendanceStatus))
@@ -163,8 +270,109 @@ class Attendance(db.Model):
             "section": self.session.section.json if self.session.section else None
         }
 
+    @property
+    def history_json(self):
+        # callers check that the current user may see this student's attendance
+        section = self.session.section
+        return {
+            "status": self.status.name,
+            "session": {
+                "id": self.session.id,
+                "startTime": self.session.start_time,
+            },
+            "section": {
+                "id": section.id,
+                "name": section.name,
+                "location": section.location,
+                "staff": section.staff.json if section.staff is not None else None,
+            } if section else None,
+        }
+
+
+@dataclass(frozen=True)
+class VisibilityContext:
+    """
+    What a user may see of the other users, so that deciding whether to
+    anonymize someone is a set lookup rather than a walk over their sections.
+    """
+
+    user_id: int
+    is_staff: bool
+    classmate_ids: FrozenSet[int]  # everyone sharing a section with the user
+
+    @classmethod
+    def for_user(cls, user: User) -> VisibilityContext:
+        if user.is_staff:
+            return cls(user_id=user.id, is_staff=True, classmate_ids=frozenset())
+        own_sections = select([user_section.c.section_id]).where(
+            user_section.c.user_id == user.id
+        )
+        classmate_ids = db.session.execute(
+            select([user_section.c.user_id]).where(
+                user_section.c.section_id.in_(own_sections)
+            )
+        )
+        return cls(
+            user_id=user.id,
+            is_staff=False,
+            classmate_ids=frozenset(user_id for (user_id,) in classmate_ids),
+        )
+
+    def can_see(self, user_id: int, is_staff: bool) -> bool:
+        return (
+            self.is_staff
+            or is_staff
+            or user_id == self.user_id
+            or user_id in self.classmate_ids
+        )
+
+
+def get_visibility() -> VisibilityContext:
+    """
+    Returns the VisibilityContext of current_user, computed at most once
+    between commits of a request.
+    """
+    visibility = g.get("visibility")
+    if visibility is None or visibility.user_id != current_user.id:
+        visibility = g.visibility = VisibilityContext.for_user(current_user)
+    return visibility
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _reset_visibility(session: OrmSession):
+    # memberships may have changed
+    if has_app_context():
+        g.pop("visibility", None)
+
+
+def enrolled_counts(section_ids: List[int]) -> Dict[int, int]:
+    """
+    Returns the number of students in each section, without loading rosters.
+    """
+    counts = db.session.execute(
+        select([user_section.c.section_id, func.count(user_section.c.user_id)])
+        .where(user_section.c.section_id.in_(section_ids))
+        .group_by(user_section.c.section_id)
+    )
+    return {section_id: 0 for section_id in section_ids} | dict(counts.fetchall())
+
+
+def anonymous_json():
+    return {
+        "id": randrange(10**6),
+        "name": "Anon Student",
+        "email": "",
+        "isStaff": False,
+        "isAdmin": False,
+    }
+
 
 class User(db.Model, UserMixin):
+    __table_args__ = (
+        # almost every endpoint looks users up by email within the course
+        db.UniqueConstraint("course", "email", name="uq_user_course_email"),
+    )
+
     # just here to make PyCharm stop complaining
     def __init__(self, email: str, name: str, is_staff: bool, course: str, is_admin: bool):
         # noinspection PyArgumentList
@@ -177,93 +385,65 @@ class User(db.Model, UserMixin):
     is_admin: bool = db.Column(db.Boolean)
 
     sections: List["Section"] = db.relationship(
-        'Section', secondary=user_section, back_populates='students', lazy='joined'
+        'Section', secondary=user_section, back_populates='students'
     )
     attendances: List["Attendance"]
 
     @property
     def json(self):
-        can_see = (
-            current_user.is_staff
-            or self.is_staff
-            or self.id == current_user.id
-            or any([s in self.sections for s in current_user.sections])
-        )
-        if can_see:
-            return {
-                "id": self.id,
-                "name": self.name,
-                "email": self.email,
-                "isStaff": self.is_staff,
-                "isAdmin": self.is_admin,
-            }
+        if get_visibility().can_see(self.id, self.is_staff):
+            return self.unredacted_json
         else:
-            return {
-                "id": randrange(10**6),
-                "name": "Anon Student",
-                "email": "",
-                "isStaff": False,
-                "isAdmin": False,
-            }
+            return anonymous_json()
+
+    @property
+    def unredacted_json(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "email": self.email,
+            "isStaff": self.is_staff,
+            "isAdmin": self.is_admin,
+        }
 
     @property
     def full_json(self):
-        attendances = (
-            Attendance.query.filter_by(student_id=self.id)
-            .options(
-                joinedload(Attendance.session, innerjoin=True)
-                .joinedload(Session.section)
-                .joinedload(Section.staff)
-            )
+        counts = dict(
+            db.session.query(Attendance.status, func.count(Attendance.id))
+            .filter(Attendance.student_id == self.id)
+            .group_by(Attendance.status)
             .all()
         )
         return {
             **self.json,
             "isAdmin": self.is_admin,
-            "attendanceHistory": [
-                attendance.full_json
-                for attendance in sorted(
-                    attendances, key=lambda attendance: attendance.session.start_time
-                )
-            ],
+            "attendanceSummary": {
+                status.name: counts.get(status, 0) for status in AttendanceStatus
+            },
         }
 
-    @property
-    def simple_json(self):
-        attendances = (
-            Attendance.query.filter_by(student_id=self.id)
+    def attendance_history(self, page: int, page_size: int) -> List[Attendance]:
+        """
+        Returns one page of the user's attendance, oldest session first, and
+        one more record than page_size if there is a next page.
+        """
+        return (
+            Attendance.query.join(Attendance.session)
+            .filter(Attendance.student_id == self.id)
             .options(
-                joinedload(Attendance.session, innerjoin=True)
+                contains_eager(Attendance.session)
                 .joinedload(Session.section)
                 .joinedload(Section.staff)
             )
+            .order_by(Session.start_time, Attendance.id)
+            .offset(page * page_size)
+            .limit(page_size + 1)
             .all()
         )
-        return {
-            **self.json,
-            "isAdmin": self.is_admin,
-            "attendanceHistory": [
-                {
-                    "status": attendance.status.name,
-                    "session": {
-                        "id": attendance.session.id,
-                        "startTime": attendance.session.start_time,
-                    },
-                    "section": {
-                        "id": attendance.session.section.id,
-                        "name": attendance.session.section.name,
-                        "location": attendance.session.section.location,
-                        "staff": attendance.session.section.staff.json
-                            if attendance.session.section.staff is not None
-                            else None,
-                    } if attendance.session.section else None,
-                }
-                for attendance in sorted(
-                    attendances, key=lambda attendance: attendance.session.start_time
-                )
-            ],
-        }
 
+    @property
+    def simple_json(self):
+        return {**self.json, "isAdmin": self.is_admin}
 
 class CourseConfig(db.Model):
     id: int = db.Column(db.Integer, primary_key=True)
@@ -303,5 +483,24 @@ class CourseConfig(db.Model):
         }
 
 
+# Loader options for each way sections are read, to pass to Query.options().
+# Relationships are lazy by default, so endpoints pick the cheapest profile
+# covering what they serialize instead of always joining in every roster.
+configure_mappers()  # sets up the backrefs referenced below
+
+# the section and its staff, e.g. to check who claimed it
+CATALOG_SUMMARY = (joinedload(Section.staff),)
+
+# everything Section.json renders
+ROSTER_DETAIL = (joinedload(Section.staff), selectinload(Section.students))
+
+# everything Section.full_json renders
+ATTENDANCE_DETAIL = ROSTER_DETAIL + (
+    selectinload(Section.sessions)
+    .selectinload(Session.attendances)
+    .lazyload(Attendance.session),  # already in the identity map
+)
+
+
 class Failure(Exception):
     pass
\ No newline at end of file
@@ -2,41 +2,64 @@ import csv
 import re
 
 from io import StringIO
+from dataclasses import dataclass
 from datetime import datetime
 from functools import wraps
+from itertools import chain
 from json import dumps
-from typing import List, Optional, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from unittest import result
-from zoneinfo import ZoneInfo
-from import_sheet import parse_time_string
+from import_sheet import check_time_string, format_timestamp, parse_time_string
 
 import flask
-from flask import abort, jsonify, render_template, request, current_app
+from flask import abort, jsonify, render_template, request, current_app, stream_with_context
 from flask_login import current_user, login_required, login_user
-from sqlalchemy.orm import joinedload
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 
-from common.course_config import format_coursecode, get_course, is_admin
+from common.course_config import format_coursecode, get_bcourses_id, get_course, is_admin
 from common.rpc.auth import post_slack_message, validate_secret
 from common.rpc.secrets import only
 from common.rpc.sections import rpc_export_attendance
 from import_sheet import import_sections_from_url, import_enrollment_from_url
+from jobs import JobResult
+import attendance_changes
+import catalog
+import jobs
 import common.canvas_service as canvas_service
 
 from models import (
+    ATTENDANCE_DETAIL,
+    CATALOG_SUMMARY,
     Attendance,
     AttendanceStatus,
     CourseConfig,
     Failure,
+    Job,
     Section,
     Session,
     User,
     db,
+    enrolled_counts,
+    user_section,
 )
 
 FIRST_WEEK_START = datetime(year=2022, month=6, day=27).timestamp()
 ONE_WEEK = 60 * 60 * 24 * 7  # number of seconds in a week
 IS_SUMMER = True
-MAX_ABSENCES = 2
+MAX_ABSENCES = 2  # excused absences allowed in a tutoring section
+MAX_UNEXCUSED_ABSENCES = 0
+ATTENDANCE_HISTORY_PAGE_SIZE = 50
+STREAM_BATCH_SIZE = 1000  # rows fetched from a server-side cursor at a time
+NO_SECTION = "Session not associated with a section"
+# one byte per attendance matrix cell
+STATUS_CODES = {
+    AttendanceStatus.present: b"P",
+    AttendanceStatus.excused: b"E",
+    AttendanceStatus.absent: b"A",
+}
+NO_STATUS = b"-"
 UNASSIGNED = "UNASSIGNED"
 
 
@@ -62,26 +85,387 @@ def admin_required(func):
     return wrapped
 
 
-def section_sorter(section: Section) -> int:
-    score = 0
-    big = 10000
-    if current_user.is_staff and section.staff is None:
-        score -= big * 100
-    if (
-        section.staff is not None
-        and section.staff.id == current_user.id
-        or current_user.id in [student.id for student in section.students]
+def parse_emails(emails):
+    return re.split(r"[\s,]+", emails.strip())
+
+
+def import_report(errors: List[str], dry_run: bool = False) -> Optional[str]:
+    if dry_run:
+        if not errors:
+            return "No problems found, the sheet is ready to import."
+        return f"Found {len(errors)} invalid rows:\n" + "\n".join(errors)
+    if not errors:
+        return None
+    return f"Skipped {len(errors)} rows:\n" + "\n".join(errors)
+
+
+def export_attendances(course: str) -> dict:
+    stringify = dumps
+    attendances = dict()
+    emails = set()
+    for user in (
+        User.query.filter_by(is_staff=False, course=course)
+        .options(joinedload(User.attendances).joinedload(Attendance.session))
+        .all()
     ):
-        score -= big * 10
-    spare_capacity = max(0, section.capacity - len(section.students))
-    if spare_capacity:
-        score -= big * spare_capacity
-    score += section.id
-    return score
+        emails.add(user.email)
+        for attendance in user.attendances:
+            try:
+                section_name = attendance.session.section.name
+            except AttributeError:
+                section_name = NO_SECTION
+            if section_name not in attendances:
+                attendances[section_name] = {}
+            if user.email not in attendances[section_name]:
+                attendances[section_name][user.email] = []
+            attendances[section_name][user.email].append(
+                {
+                    "section_id": attendance.session.section_id,
+                    "start_time": attendance.session.start_time,
+                    "status": attendance.status.name,
+                }
+            )
+    for email in emails:
+        for attendance in attendances.values():
+            if email not in attendance:
+                attendance[email] = []
+
+    return {
+        "fileName": "attendances.json",
+        "attendances": stringify(
+            [{"type": k, "attendances": v} for k, v in attendances.items()]
+        ),
+    }
+
+
+def export_attendance_changes(course: str, since: Optional[str] = None) -> dict:
+    """
+    Returns the attendance records written since the cursor of an earlier
+    export, split into changed (including new) and deleted ones, along with
+    the cursor to pass next time. Returns the full export_attendances instead,
+    marked as full, without a cursor or when the cursor is too old to diff.
+    """
+    # every change up to the cursor has committed, and reading it first means a
+    # concurrent write can only be exported twice, never skipped
+    until = attendance_changes.latest_cursor(course)
+    rows = None
+    if since is not None and since.isdigit() and int(since) <= until:
+        rows = attendance_changes.changes_since(course, int(since), until)
+    if rows is None:
+        return {**export_attendances(course), "cursor": str(until), "full": True}
+
+    changed, deleted = [], []
+    for email, name, section_id, start_time, status in rows:
+        record = {
+            "email": email,
+            "type": name if name is not None else NO_SECTION,
+            "section_id": section_id,
+            "start_time": start_time,
+        }
+        if status is None:
+            deleted.append(record)
+        else:
+            changed.append({**record, "status": status.name})
+    return {"cursor": str(until), "full": False, "changed": changed, "deleted": deleted}
+
+
+def stream_attendances(course: str) -> Iterator[str]:
+    """
+    Yields the attendance export of the course as NDJSON, one line per student
+    holding the same records as export_attendances, e.g.
+    {"email": ..., "attendances": {"Lab": [{"section_id": ..., ...}], ...}}.
+    Rows are read from a server-side cursor in student order, so only one
+    student is held in memory at a time.
+    """
+    user, attendance, session, section = (
+        User.__table__,
+        Attendance.__table__,
+        Session.__table__,
+        Section.__table__,
+    )
+    recorded = attendance.join(session).outerjoin(section)
+    of_course = and_(user.c.course == course, ~user.c.is_staff)
+    # every student lists every type with any attendance, as export_attendances does
+    section_names = [
+        name if name is not None else NO_SECTION
+        for (name,) in db.session.execute(
+            select([section.c.name])
+            .select_from(user.join(recorded, attendance.c.student_id == user.c.id))
+            .where(of_course)
+            .distinct()
+        )
+    ]
+
+    rows = db.session.execute(
+        select(
+            [
+                user.c.email,
+                attendance.c.id,
+                section.c.name,
+                session.c.section_id,
+                session.c.start_time,
+                attendance.c.status,
+            ]
+        )
+        .select_from(user.outerjoin(recorded, attendance.c.student_id == user.c.id))
+        .where(of_course)
+        .order_by(user.c.id, session.c.start_time)
+        .execution_options(stream_results=True)
+    )
+
+    def line(email, records):
+        return dumps({"email": email, "attendances": records}) + "\n"
+
+    email, records = None, None
+    while True:
+        batch = rows.fetchmany(STREAM_BATCH_SIZE)
+        if not batch:
+            break
+        for row_email, attendance_id, name, section_id, start_time, status in batch:
+            if row_email != email:
+                if email is not None:
+                    yield line(email, records)
+                email, records = row_email, {name: [] for name in section_names}
+            if attendance_id is not None:
+                records[name if name is not None else NO_SECTION].append(
+                    {"section_id": section_id, "start_time": start_time, "status": status.name}
+                )
+    if email is not None:
+        yield line(email, records)
+
+
+def csv_lines(rows: Iterable[list]) -> Iterator[str]:
+    out = StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow(row)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+@dataclass
+class AttendanceMatrix:
+    """
+    The attendance of a course as a students x sessions grid, holding the
+    status code of each cell in one bytearray per student.
+    """
+
+    columns: List[Tuple[str, int]]  # (section type, session start time)
+    emails: List[str]
+    rows: List[bytearray]
+
+    def csv(self) -> Iterator[str]:
+        # cells hold the status code, or nothing for sessions without a record
+        no_status = NO_STATUS.decode()
+        yield from csv_lines(
+            chain(
+                [["Email"] + [f"{name} {start_time}" for name, start_time in self.columns]],
+                (
+                    [email] + [code if code != no_status else "" for code in row.decode()]
+                    for email, row in zip(self.emails, self.rows)
+                ),
+            )
+        )
 
+    def compact_json(self) -> dict:
+        return {
+            "statuses": {code.decode(): status.name for status, code in STATUS_CODES.items()},
+            "columns": self.columns,
+            "students": [
+                [email, row.decode()] for email, row in zip(self.emails, self.rows)
+            ],
+        }
 
-def parse_emails(emails):
-    return re.split(r"[\s,]+", emails.strip())
+
+def attendance_matrix(course: str) -> AttendanceMatrix:
+    """
+    Returns the attendance of every student in the course, with a column per
+    section type and session start time, in two queries.
+    """
+    user, attendance, session, section = (
+        User.__table__,
+        Attendance.__table__,
+        Session.__table__,
+        Section.__table__,
+    )
+    of_course = and_(user.c.course == course, ~user.c.is_staff)
+
+    rows = db.session.execute(
+        select([user.c.id, section.c.name, session.c.start_time, attendance.c.status])
+        .select_from(
+            user.join(attendance, attendance.c.student_id == user.c.id)
+            .join(session)
+            .outerjoin(section)
+        )
+        .where(of_course)
+    ).fetchall()
+    columns = sorted(
+        {(name if name is not None else NO_SECTION, start_time) for _, name, start_time, _ in rows}
+    )
+    column_index = {column: i for i, column in enumerate(columns)}
+
+    students = db.session.execute(
+        select([user.c.id, user.c.email]).where(of_course).order_by(user.c.id)
+    ).fetchall()
+    matrix = AttendanceMatrix(
+        columns=columns,
+        emails=[email for _, email in students],
+        rows=[bytearray(NO_STATUS * len(columns)) for _ in students],
+    )
+    row_index: Dict[int, int] = {user_id: i for i, (user_id, _) in enumerate(students)}
+    for user_id, name, start_time, status in rows:
+        column = column_index[name if name is not None else NO_SECTION, start_time]
+        matrix.rows[row_index[user_id]][column] = STATUS_CODES[status][0]
+    return matrix
+
+
+def roster_rows(course: str) -> Iterator[list]:
+    """
+    Yields the rows of the rosters CSV, in the format import_enrollment reads:
+    a header, then one row per enrolled student and section. Rows are read
+    from a server-side cursor of one section/student/staff join.
+    """
+    yield ["Student Email", "Staff Email", "Location", "Day", "Start", "Type"]
+
+    student, staff = User.__table__.alias("student"), User.__table__.alias("staff")
+    section = Section.__table__
+    rows = db.session.execute(
+        select(
+            [
+                student.c.email,
+                staff.c.email,
+                section.c.location,
+                section.c.start_time,
+                section.c.name,
+            ]
+        )
+        .select_from(
+            section.join(user_section, user_section.c.section_id == section.c.id)
+            .join(student, student.c.id == user_section.c.user_id)
+            .outerjoin(staff, staff.c.id == section.c.staff_id)
+        )
+        .where(section.c.course == course)
+        .order_by(section.c.id, student.c.id)
+        .execution_options(stream_results=True)
+    )
+    while True:
+        batch = rows.fetchmany(STREAM_BATCH_SIZE)
+        if not batch:
+            break
+        for student_email, staff_email, location, start_time, name in batch:
+            day = ""
+            start = ""
+
+            try:
+                if isinstance(start_time, (int, float)):
+                    day, start = format_timestamp(start_time)  # e.g. "M", "08:00a"
+                else:
+                    # fallback: output as-is (just as a string)
+                    start = str(start_time or "")
+            except Exception:
+                day = ""
+                start = str(start_time or "")
+
+            yield [student_email, staff_email or "", location or "", day, start, name or ""]
+
+
+def students_to_drop(
+    course: str,
+    max_absences: int = MAX_UNEXCUSED_ABSENCES,
+    max_excused: int = MAX_ABSENCES,
+) -> List[dict]:
+    """
+    Returns the students with more unexcused absences or more excused ones in
+    their tutoring section than allowed, counted in one grouped query.
+    """
+    user, attendance, session, section = (
+        User.__table__,
+        Attendance.__table__,
+        Session.__table__,
+        Section.__table__,
+    )
+    absences = func.sum(case([(attendance.c.status == AttendanceStatus.absent, 1)], else_=0))
+    excused = func.sum(case([(attendance.c.status == AttendanceStatus.excused, 1)], else_=0))
+    return [
+        {"email": email, "name": name, "absences": int(absent), "excused": int(excused_count)}
+        for email, name, absent, excused_count in db.session.execute(
+            select([user.c.email, user.c.name, absences, excused])
+            .select_from(
+                user.join(user_section, user_section.c.user_id == user.c.id)
+                .join(section, section.c.id == user_section.c.section_id)
+                .join(session, session.c.section_id == section.c.id)
+                .join(
+                    attendance,
+                    and_(
+                        attendance.c.session_id == session.c.id,
+                        attendance.c.student_id == user.c.id,
+                    ),
+                )
+            )
+            .where(
+                and_(
+                    user.c.course == course,
+                    ~user.c.is_staff,
+                    section.c.name == "Tutoring",
+                )
+            )
+            .group_by(user.c.id, user.c.email, user.c.name)
+            .having(or_(absences > max_absences, excused > max_excused))
+            .order_by(user.c.id)
+        )
+    ]
+
+
+def reset_course(course: str, keep_user_id: Optional[int] = None):
+    """
+    Deletes every section, session, attendance and user of the course, except
+    the user with the given id, e.g. the admin polling the reset job.
+    """
+    for section in Section.query.filter_by(course=course).all():
+        section.staff = None
+    Attendance.query.filter_by(course=course).delete()
+    attendance_changes.record_changes(course)
+    Session.query.filter_by(course=course).delete()
+
+    for user in (
+        User.query.filter_by(course=course).options(selectinload(User.sections)).all()
+    ):
+        user.sections.clear()
+
+    User.query.filter(User.course == course, User.id != keep_user_id).delete()
+    Section.query.filter_by(course=course).delete()
+    catalog.record_change(course)
+    db.session.commit()
+
+
+@jobs.handler("import_sections")
+def import_sections_job(course: str, progress, url: str, atomic: bool, dry_run: bool):
+    errors = import_sections_from_url(url, course, atomic, dry_run, progress)
+    return JobResult(message=import_report(errors, dry_run))
+
+
+@jobs.handler("import_enrollment")
+def import_enrollment_job(course: str, progress, url: str, atomic: bool, dry_run: bool):
+    errors = import_enrollment_from_url(url, course, atomic, dry_run, progress)
+    return JobResult(message=import_report(errors, dry_run))
+
+
+@jobs.handler("reset_sections", retryable=True)  # commits once, at the end
+def reset_sections_job(course: str, progress, keep_user_id: int):
+    reset_course(course, keep_user_id)
+
+
+@jobs.handler("export_attendance", retryable=True)
+def export_attendance_job(course: str, progress):
+    return JobResult(payload=export_attendances(course))
+
+
+@jobs.handler("fetch_to_drop", retryable=True)
+def fetch_to_drop_job(course: str, progress, max_absences: int, max_excused: int):
+    return JobResult(
+        payload={"students": students_to_drop(course, max_absences, max_excused)}
+    )
 
 
 def get_config() -> CourseConfig:
@@ -98,7 +482,42 @@ def add_student_helper(student: User, target_section: Section):
             break
     student.sections.append(target_section)
 
+def replace_attendance(
+    session_id: int, student_ids: List[int], status: Optional[AttendanceStatus]
+):
+    """
+    Sets the attendance of every student in the session at once, or clears it
+    if status is None, by deleting their records and inserting new ones, so
+    record ids do not survive.
+    """
+    # not an upsert: the (session_id, student_id) unique constraint is only
+    # declared in the model, and deployed databases may not have it
+    Attendance.query.filter(
+        Attendance.session_id == session_id,
+        Attendance.student_id.in_(student_ids),
+    ).delete(synchronize_session=False)
+    attendance_changes.record_changes(
+        get_course(), [(session_id, student_id) for student_id in student_ids]
+    )
+    if status is None or not student_ids:
+        return
+    rows = [
+        dict(
+            status=status,
+            session_id=session_id,
+            student_id=student_id,
+            course=get_course(),
+        )
+        for student_id in student_ids
+    ]
+    db.session.execute(Attendance.__table__.insert(), rows)
+
+
 def create_state_client(app: flask.Flask):
+    @app.before_first_request
+    def start_job_workers():
+        jobs.start_workers(app)
+
     def api(handler):
         def wrapped():
             try:
@@ -152,16 +571,60 @@ def create_state_client(app: flask.Flask):
     def generic(**_):
         return render_template("index.html", course=format_coursecode(get_course()))
 
+    def download(file_name: str, mimetype: str):
+        """
+        Serves the lines yielded by the handler to course admins as a file
+        download at /export/<file_name>, sending each line as it is produced.
+        """
+
+        def decorator(handler):
+            @login_required
+            def wrapped():
+                if not (current_user.is_staff and current_user.is_admin):
+                    abort(403)
+                return flask.Response(
+                    stream_with_context(handler()),
+                    mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={file_name}"},
+                )
+
+            app.add_url_rule(f"/export/{file_name}", handler.__name__, wrapped)
+            return handler
+
+        return decorator
+
+    @download("rosters.csv", "text/csv")
+    def download_rosters():
+        return csv_lines(roster_rows(get_course()))
+
+    @download("attendances.ndjson", "application/x-ndjson")
+    def download_attendances():
+        return stream_attendances(get_course())
+
+    @download("attendance_matrix.csv", "text/csv")
+    def download_attendance_matrix_csv():
+        return attendance_matrix(get_course()).csv()
+
+    @download("attendance_matrix.json", "application/json")
+    def download_attendance_matrix_json():
+        yield dumps(attendance_matrix(get_course()).compact_json(), separators=(",", ":"))
+
     @app.route("/debug")
     def debug():
         refresh_state()
         return "<body></body>"
 
     @api
-    def refresh_state():
+    def refresh_state(version: Optional[str] = None):
         """
         Returns overall information about the section in json.
 
+        If the client passes the version of the last state it received, only
+        the sections added or changed since then are returned, and the ids of
+        deleted ones are listed in deletedSectionIds. A full snapshot, with
+        deletedSectionIds set to None, is returned when that version is too
+        old to diff against.
+
         Backend API functions calling refresh_state should be called
         using the useAPI hook in frontend.
         """
@@ -175,6 +638,8 @@ def create_state_client(app: flask.Flask):
             "enrolledSections": None,
             "taughtSections": None,
             "sections": [],
+            "deletedSectionIds": None,
+            "version": None,
             "currentUser": None,
             "course": format_coursecode(get_course()),
             "config": config.json,
@@ -182,21 +647,36 @@ def create_state_client(app: flask.Flask):
         }
 
         if current_user.is_authenticated:
+            course_catalog = catalog.get_catalog(get_course())
+            viewer = course_catalog.viewer(current_user)
+            sections = course_catalog.ordered_sections(viewer)
             out["enrolledSections"] = [
-                section.json
-                for section in sorted(current_user.sections, key=section_sorter)
+                section.render(viewer)
+                for section in sections
+                if current_user.id in section.member_ids
             ]
             out["taughtSections"] = [
-                section.json
-                for section in sorted(current_user.sections_taught, key=section_sorter)
-            ]
-            out["sections"] = [
-                section.json
-                for section in sorted(
-                    Section.query.filter_by(course=get_course()).all(),
-                    key=section_sorter,
-                )
+                section.render(viewer)
+                for section in sections
+                if section.staff_id == current_user.id
             ]
+            changed_ids = (
+                course_catalog.changes_since(version, viewer) if version else None
+            )
+            if changed_ids is None:
+                out["sections"] = [section.render(viewer) for section in sections]
+            else:
+                out["sections"] = [
+                    section.render(viewer)
+                    for section in sections
+                    if section.id in changed_ids
+                ]
+                out["deletedSectionIds"] = [
+                    str(section_id)
+                    for section_id in sorted(changed_ids)
+                    if section_id not in course_catalog.sections
+                ]
+            out["version"] = course_catalog.cursor(viewer)
             out["currentUser"] = current_user.full_json
 
         return out
@@ -211,12 +691,17 @@ def create_state_client(app: flask.Flask):
         called using the useSectionAPI hook in frontend.
         """
         section_id = int(section_id)
-        section = Section.query.filter_by(id=section_id, course=get_course()).first()
+        section = (
+            Section.query.filter_by(id=section_id, course=get_course())
+            .options(*ATTENDANCE_DETAIL)
+            .first()
+        )
         if not section:
             return {
                 "id": section_id,
                 "staff": None,
                 "students": [],
+                "enrolledCount": 0,
                 "description": "",
                 "capacity": -1,
                 "canSelfEnroll": False,
@@ -268,7 +753,7 @@ def create_state_client(app: flask.Flask):
             if target_section.name == "Tutoring" and not config.can_students_change_tutoring:
                 raise Failure("Students cannot change their enrolled tutorials!")
 
-        if target_section.capacity <= len(target_section.students):
+        if target_section.capacity <= enrolled_counts([target_section.id])[target_section.id]:
             raise Failure("Target tutorial section is already full.")
         if (
             target_section.needs_enrollment_code
@@ -324,7 +809,11 @@ def create_state_client(app: flask.Flask):
     @staff_required
     def claim_section(section_id: str):
         section_id = int(section_id)
-        section = Section.query.filter_by(id=section_id, course=get_course()).one()
+        section = (
+            Section.query.filter_by(id=section_id, course=get_course())
+            .options(*CATALOG_SUMMARY)
+            .one()
+        )
         if section.name == "Lab":
             if not get_config().can_tutors_change_lab:
                 raise Failure("Tutors cannot add themselves to labs!")
@@ -345,7 +834,11 @@ def create_state_client(app: flask.Flask):
     @staff_required
     def unassign_section(section_id: str):
         section_id = int(section_id)
-        section = Section.query.filter_by(id=section_id, course=get_course()).one()
+        section = (
+            Section.query.filter_by(id=section_id, course=get_course())
+            .options(*CATALOG_SUMMARY)
+            .one()
+        )
         if section.staff is None:
             raise Failure("Section is already unassigned!")
         if section.staff.email == current_user.email:
@@ -402,6 +895,9 @@ def create_state_client(app: flask.Flask):
     @admin_required
     def update_section_time(section_id: str, day: str, start_time: str, end_time: str):
         section_id = int(section_id)
+        error = check_time_string(day, start_time) or check_time_string(day, end_time)
+        if error:
+            raise Failure(f"Unable to update section time: {error}")
         section = Section.query.filter_by(id=section_id, course=get_course()).one()
         section.start_time = parse_time_string(day, start_time)
         section.end_time = parse_time_string(day, end_time)
@@ -432,7 +928,12 @@ def create_state_client(app: flask.Flask):
                     course=get_course(),
                 )
             )
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # another request started the same session first, fetch_section
+                # below reads the session it created
+                db.session.rollback()
         return fetch_section(section_id=section_id)
 
     @api
@@ -440,23 +941,17 @@ def create_state_client(app: flask.Flask):
     def set_attendance(session_id: str, students: str, status: Optional[str]):
         session_id = int(session_id)
         session = Session.query.filter_by(id=session_id, course=get_course()).one()
-        status = AttendanceStatus[status]
-        for email in parse_emails(students):
-            student = User.query.filter_by(
-                email=email, course=get_course()
-            ).one_or_none()
-            if student is None:
-                raise Failure(f"Student {email} is not enrolled")
-            Attendance.query.filter_by(session_id=session_id, student=student).delete()
-            if student is not None and status is not None:
-                db.session.add(
-                    Attendance(
-                        status=status,
-                        session_id=session_id,
-                        student=student,
-                        course=get_course(),
-                    )
-                )
+        status = AttendanceStatus[status] if status is not None else None
+        emails = list(dict.fromkeys(parse_emails(students)))
+        student_ids = dict(
+            db.session.query(User.email, User.id)
+            .filter(User.course == get_course(), User.email.in_(emails))
+            .all()
+        )
+        unknown = [email for email in emails if email not in student_ids]
+        if unknown:
+            raise Failure(f"Students not enrolled: {', '.join(unknown)}")
+        replace_attendance(session_id, list(student_ids.values()), status)
         db.session.commit()
         return fetch_section(section_id=session.section_id)
 
@@ -520,24 +1015,39 @@ def create_state_client(app: flask.Flask):
     def add_students(emails: str, section_id: str):
         section_id = int(section_id)
         section = Section.query.filter_by(id=section_id, course=get_course()).one()
-        for email in parse_emails(emails):
-            student = User.query.filter_by(
-                email=email, course=get_course()
-            ).one_or_none()
-            if student is not None and student.is_staff:
-                raise Failure("Attempted to add staff: {student.name}")
-            if student is None:
-                try:
-                    canvasname = canvas_service.get_student_from_email(email)
-                except Exception as e:
-                    return Failure("Adding student failed. Make sure the email is correct and belongs to this class.")
-
-                if (not canvasname):
-                    raise Failure("Could not find email that belongs to this class")
-                student = User(
-                    email=email, name=canvasname, is_staff=False, is_admin=False, course=get_course()
+        emails = list(dict.fromkeys(parse_emails(emails)))
+        students = {
+            student.email: student
+            for student in User.query.filter(
+                User.course == get_course(), User.email.in_(emails)
+            )
+            .options(selectinload(User.sections))
+            .all()
+        }
+        staff = [student.name for student in students.values() if student.is_staff]
+        if staff:
+            raise Failure(f"Attempted to add staff: {', '.join(staff)}")
+
+        missing = [email for email in emails if email not in students]
+        if missing:
+            try:
+                canvasnames = canvas_service.get_students_from_emails(missing)
+            except Exception as e:
+                return Failure("Adding student failed. Make sure the email is correct and belongs to this class.")
+
+            not_found = [email for email in missing if not canvasnames.get(email)]
+            if not_found:
+                raise Failure(
+                    f"Could not find emails that belong to this class: {', '.join(not_found)}"
+                )
+            for email in missing:
+                students[email] = User(
+                    email=email, name=canvasnames[email], is_staff=False, is_admin=False, course=get_course()
                 )
-            add_student_helper(student, section)
+            db.session.add_all(students[email] for email in missing)
+
+        for email in emails:
+            add_student_helper(students[email], section)
         db.session.commit()
         return fetch_section(section_id=section_id)
 
@@ -546,7 +1056,7 @@ def create_state_client(app: flask.Flask):
     def delete_section(section_id: str):
         section_id = int(section_id)
         section = Section.query.filter_by(id=section_id, course=get_course()).one()
-        if section.students:
+        if enrolled_counts([section.id])[section.id]:
             raise Failure("Cannot delete a non-empty section")
         db.session.delete(section)
         db.session.commit()
@@ -556,13 +1066,18 @@ def create_state_client(app: flask.Flask):
     @api
     @admin_required
     def export_attendance():
-        return export_helper()
+        job = jobs.enqueue("export_attendance")
+        return {**refresh_state(), "custom": {"jobId": str(job.id)}}
 
     @rpc_export_attendance.bind(app)
     @only("grade-display", allow_staging=True)
-    def export_attendance_rpc():
-        login_user(User.query.filter_by(course = get_course(), is_staff=True).first())
-        return export_helper()
+    def export_attendance_rpc(since: Optional[str] = None):
+        """
+        Pass the cursor of the previous export as since to only receive the
+        attendance records changed or deleted after it.
+        """
+        # without the rest of the state, so a sync costs what changed since
+        return {"custom": export_attendance_changes(get_course(), since)}
 
     @api
     def export_attendance_secret(secret: str):
@@ -570,91 +1085,17 @@ def create_state_client(app: flask.Flask):
             return export_helper()
 
     def export_helper():
-        stringify = dumps
-        attendances = dict()
-        emails = set()
-        for user in (
-            User.query.filter_by(is_staff=False, course=get_course())
-            .options(joinedload(User.attendances).joinedload(Attendance.session))
-            .all()
-        ):
-            emails.add(user.email)
-            for attendance in user.attendances:
-                try:
-                    section_name = attendance.session.section.name
-                except AttributeError:
-                    section_name = "Session not associated with a section"
-                if section_name not in attendances:
-                    attendances[section_name] = {}
-                if user.email not in attendances[section_name]:
-                    attendances[section_name][user.email] = []
-                attendances[section_name][user.email].append(
-                    {
-                        "section_id": attendance.session.section_id,
-                        "start_time": attendance.session.start_time,
-                        "status": attendance.status.name,
-                    }
-                )
-        for email in emails:
-            for attendance in attendances.values():
-                if email not in attendance:
-                    attendance[email] = []
-
-        return {
-            **refresh_state(),
-            "custom": {
-                "fileName": "attendances.json",
-                "attendances": stringify(
-                    [{"type": k, "attendances": v} for k, v in attendances.items()]
-                ),
-            },
-        }
+        return {**refresh_state(), "custom": export_attendances(get_course())}
 
     @api
     @admin_required
     def export_rosters():
-        # Produce CSV based on Import Enrollment Form Style:
-        # Column titles are Student Email, Staff Email, Location, Day, Start, Type
-        out = StringIO()
-        writer = csv.writer(out)
-        writer.writerow(["Student Email", "Staff Email", "Location", "Day", "Start", "Type"])
-
-        for section in Section.query.filter_by(course=get_course()).all():
-            staff_email = section.staff.email if section.staff else ""
-            location = section.location or ""
-            day = ""
-            start = ""
-
-            DAY_MAP = {
-                0: "M",
-                1: "T",
-                2: "W",
-                3: "Th",
-                4: "F",
-            }
-
-            try:
-
-                if isinstance(section.start_time, (int, float)):
-                    # Interpret stored UNIX timestamps in America/LA timezones
-                    tz = ZoneInfo("America/Los_Angeles")
-                    dt = datetime.fromtimestamp(section.start_time, tz=tz)
-                    day = DAY_MAP.get(dt.weekday(), "")  # e.g. "M", "Tu"
-                    start = dt.strftime("%I:%M%p").lower().replace('m', '')  # e.g. "08:00a"
-                else:
-                    # fallback: output as-is (just as a string)
-                    start = str(section.start_time or "")
-            except Exception:
-                day = ""
-                start = str(section.start_time or "")
-
-            for student in section.students:
-                writer.writerow([student.email, staff_email, location, day, start, section.name or ""])
-
-        csv_text = out.getvalue()
         return {
             **refresh_state(),
-            "custom": {"fileName": "rosters.csv", "rosters": csv_text},
+            "custom": {
+                "fileName": "rosters.csv",
+                "rosters": "".join(csv_lines(roster_rows(get_course()))),
+            },
         }
 
     @api
@@ -666,6 +1107,30 @@ def create_state_client(app: flask.Flask):
             raise Failure(f"No user found with id {user_id}")
         return user.simple_json
 
+    @api
+    @login_required
+    def fetch_attendance_history(user_id: Optional[str] = None, page: int = 0):
+        """
+        Returns a page of a user's attendance history, defaulting to the
+        current user's. Only staff can read other users' history.
+        """
+        user_id = current_user.id if user_id is None else int(user_id)
+        if user_id != current_user.id and not current_user.is_staff:
+            raise Failure("Attendance data of other users is staff-only")
+        user = User.query.filter_by(id=user_id, course=get_course()).one_or_none()
+        if user is None:
+            raise Failure(f"No user found with id {user_id}")
+        page = int(page)
+        attendances = user.attendance_history(page, ATTENDANCE_HISTORY_PAGE_SIZE)
+        has_next_page = len(attendances) > ATTENDANCE_HISTORY_PAGE_SIZE
+        return {
+            "attendanceHistory": [
+                attendance.history_json
+                for attendance in attendances[:ATTENDANCE_HISTORY_PAGE_SIZE]
+            ],
+            "nextPage": page + 1 if has_next_page else None,
+        }
+
     @api
     @staff_required
     def get_userid(email: str):
@@ -677,9 +1142,11 @@ def create_state_client(app: flask.Flask):
     @api
     @admin_required
     def remind_tutors_to_setup_zoom_links():
-        sections: List[Section] = Section.query.filter_by(
-            call_link=None, course=get_course()
-        ).all()
+        sections: List[Section] = (
+            Section.query.filter_by(call_link=None, course=get_course())
+            .options(*CATALOG_SUMMARY)
+            .all()
+        )
         tutor_emails = set()
         for section in sections:
             tutor_emails.add(section.staff.email)
@@ -697,77 +1164,53 @@ def create_state_client(app: flask.Flask):
 
         return refresh_state()
 
+
     @api
     @admin_required
-    def import_sections_from_sheet(url: str):
-        import_sections_from_url(url)
+    def refresh_canvas_roles():
+        # roles and the student roster are cached by every process, this makes
+        # bCourses changes apply on the next login or student lookup
+        canvas_service.invalidate_roles(get_bcourses_id())
+        canvas_service.invalidate_roster(get_bcourses_id())
+        db.session.commit()
         return refresh_state()
 
     @api
     @admin_required
-    def import_enrollment_from_sheet(url: str):
-        import_enrollment_from_url(url)
-        return refresh_state()
+    def import_sections_from_sheet(url: str, atomic: bool = True, dry_run: bool = False):
+        job = jobs.enqueue("import_sections", url=url, atomic=atomic, dry_run=dry_run)
+        return {**refresh_state(), "custom": {"jobId": str(job.id)}}
 
     @api
     @admin_required
-    def reset_sections():
-        course = get_course()
-        for section in Section.query.filter_by(course=course).all():
-            section.staff = None
-        Attendance.query.filter_by(course=course).delete()
-        Session.query.filter_by(course=course).delete()
+    def import_enrollment_from_sheet(url: str, atomic: bool = True, dry_run: bool = False):
+        job = jobs.enqueue("import_enrollment", url=url, atomic=atomic, dry_run=dry_run)
+        return {**refresh_state(), "custom": {"jobId": str(job.id)}}
 
-        for user in User.query.filter_by(course=course).all():
-            user.sections.clear()
+    @api
+    @staff_required
+    def fetch_job(job_id: str):
+        job = Job.query.filter_by(id=int(job_id), course=get_course()).one_or_none()
+        # results can hold admin-only data, such as the attendance export
+        if job is None or not (current_user.is_admin or job.created_by == current_user.id):
+            raise Failure("Job not found")
+        return job.json
 
-        User.query.filter_by(course=course).delete()
-        Section.query.filter_by(course=course).delete()
-        db.session.commit()
-        return refresh_state()
+    @api
+    @admin_required
+    def reset_sections():
+        job = jobs.enqueue("reset_sections", keep_user_id=current_user.id)
+        return {**refresh_state(), "custom": {"jobId": str(job.id)}}
 
     @api
     @admin_required
-    def fetch_to_drop():
-        students = ""
-        for student in (
-            User.query.filter_by(is_staff=False, course=get_course())
-            .filter(User.sections.any())
-            .all()
-        ):
-            tutoring_section = None
-            absences = []
-            excused = []
-            if student:
-                for section in student.sections:
-                    if section.name == 'Tutoring':
-                        tutoring_section = section
-            if tutoring_section:
-                excused = (Attendance.query.join(Attendance.session)
-                .filter(
-                    Attendance.student_id == student.id,
-                    Attendance.status == AttendanceStatus.excused,
-                    Session.section_id == tutoring_section.id
-                )
-                .options(joinedload(Attendance.session))
-                .all()
-                )
-            if tutoring_section:
-                absences = (Attendance.query.join(Attendance.session)
-                .filter(
-                    Attendance.student_id == student.id,
-                    Attendance.status == AttendanceStatus.absent,
-                    Session.section_id == tutoring_section.id
-                )
-                .options(joinedload(Attendance.session))
-                .all()
-                )
-            if (len(absences) >= 1 or len(excused) >= 3):
-                students += student.email + ", "
-        return {
-            **refresh_state(),
-            "custom": {"students": students[:-2]},
-        }
+    def fetch_to_drop(
+        max_absences: int = MAX_UNEXCUSED_ABSENCES, max_excused: int = MAX_ABSENCES
+    ):
+        job = jobs.enqueue(
+            "fetch_to_drop", max_absences=int(max_absences), max_excused=int(max_excused)
+        )
+        return {**refresh_state(), "custom": {"jobId": str(job.id)}}
 
     @api
     @admin_required
@@ -21,6 +21,7 @@ import ImportEnrollmentModal from "./ImportEnrollmentModal";
 import StateContext from "./StateContext";
 import ToggleSwitch from "./ToggleSwitch";
 import useAPI from "./useStateAPI";
+import useJobAPI from "./useJobAPI";
 import AddStudentModal from "./AddStudentModal";
 import ResetSectionsModal from "./ResetSectionsModal";
 import MessageContext from "./MessageContext";
@@ -42,10 +43,12 @@ export default function AdminPage(): React.Node {
   const removeStudentsFromTutoring = useAPI("remove_students_from_tutoring");
 
   const updateConfig = useAPI("update_config");
-  const exportAttendance = useAPI(
+  const exportAttendance = useJobAPI(
     "export_attendance",
-    ({ custom: { attendances, fileName } }) => {
+    ({ message, result }) => {
+      const { attendances, fileName } = result ?? {};
       if (attendances == null || fileName == null) {
+        pushMessage(message ?? "Export failed.");
         return;
       }
       const element = document.createElement("a");
@@ -63,32 +66,15 @@ export default function AdminPage(): React.Node {
       document.body?.removeChild(element);
     }
   );
-  const exportRosters = useAPI(
-    "export_rosters",
-    ({ custom: { rosters, fileName } }) => {
-      if (rosters == null || fileName == null) {
-        return;
-      }
-      const element = document.createElement("a");
-      element.setAttribute(
-        "href",
-        `data:text/plain;charset=utf-8,${encodeURIComponent(rosters)}`
-      );
-      element.setAttribute("download", fileName);
-
-      element.style.display = "none";
-      // eslint-disable-next-line no-unused-expressions
-      document.body?.appendChild(element);
-      element.click();
-      // eslint-disable-next-line no-unused-expressions
-      document.body?.removeChild(element);
-    }
-  );
-  const fetchToDrop = useAPI("fetch_to_drop", ({ custom: {students}}) => {
+  const fetchToDrop = useJobAPI("fetch_to_drop", ({ message, result }) => {
+    const students = result?.students;
     if (students == null) {
+      pushMessage(message ?? "Unable to fetch students to drop.");
       return;
     }
-    navigator.clipboard.writeText(students);
+    navigator.clipboard.writeText(
+      students.map(({ email }) => email).join(", ")
+    );
     pushMessage("Copied");
   });
   const remindTutorsToSetupZoomLinks = useAPI(
@@ -96,7 +82,12 @@ export default function AdminPage(): React.Node {
   );
 
   const [resetting, setResetting] = useState(false);
-  const resetSections = useAPI("reset_sections");
+  const resetSections = useJobAPI("reset_sections", ({ message, status }) =>
+    pushMessage(message ?? (status === "failed" ? "Reset failed." : "Reset complete."))
+  );
+  const refreshCanvasRoles = useAPI("refresh_canvas_roles", () =>
+    pushMessage("Roles and the roster will be refreshed from bCourses on next use")
+  );
 
   type ConfigKey = "canStudentsJoinLab" | "canStudentsChangeLab" | "canTutorsChangeLab" | "canTutorsReassignLab" | 
   "canStudentsJoinDiscussion" | "canStudentsChangeDiscussion" | "canTutorsChangeDiscussion" | "canTutorsReassignDiscussion" | 
@@ -290,10 +281,7 @@ export default function AdminPage(): React.Node {
 
               {/* Line 2: Export Buttons */}
               <p>
-                <Button
-                  variant="secondary"
-                  onClick={() => exportRosters({})}
-                >
+                <Button variant="secondary" href="/export/rosters.csv">
                   Export Rosters
                 </Button>{" "}
                 <Button
@@ -301,6 +289,15 @@ export default function AdminPage(): React.Node {
                   onClick={() => exportAttendance({})}
                 >
                   Export Full Attendances
+                </Button>{" "}
+                <Button variant="secondary" href="/export/attendances.ndjson">
+                  Download Attendances (NDJSON)
+                </Button>{" "}
+                <Button variant="secondary" href="/export/attendance_matrix.csv">
+                  Download Attendance Matrix (CSV)
+                </Button>{" "}
+                <Button variant="secondary" href="/export/attendance_matrix.json">
+                  Download Attendance Matrix (JSON)
                 </Button>
               </p>
 
@@ -350,7 +347,13 @@ export default function AdminPage(): React.Node {
                     show={resetting}
                     onReset={() => resetSections()}
                     onClose={() => setResetting(false)}
-                  />
+                  />{" "}
+                  <Button
+                    variant="secondary"
+                    onClick={() => refreshCanvasRoles()}
+                  >
+                    Refresh bCourses Roles and Roster
+                  </Button>
                 </p>
               )}
 
@@ -19,7 +19,7 @@ import MainPage from "./MainPage";
 import "bootstrap/dist/css/bootstrap.css";
 import MessageContext from "./MessageContext";
 import Messages from "./Messages";
-import type { ID, State } from "./models";
+import type { ID, Section, State } from "./models";
 import SectionPage from "./SectionPage";
 import StateContext from "./StateContext";
 import useAPI from "./useStateAPI";
@@ -34,6 +34,22 @@ export default function App(): React.Node {
   );
 
   const updateState = (newState: State) => {
+    if (state != null && newState.deletedSectionIds != null) {
+      // merge a delta into the sections we already have
+      const deleted = new Set(newState.deletedSectionIds);
+      const changed = new Map<ID, Section>();
+      newState.sections.forEach((section) => changed.set(section.id, section));
+      const sections = state.sections
+        .filter((section) => !deleted.has(section.id))
+        .map((section) => {
+          const newSection = changed.get(section.id) ?? section;
+          changed.delete(section.id);
+          return newSection;
+        })
+        .concat(Array.from(changed.values()));
+      setState({ ...newState, sections });
+      return;
+    }
     // preserve ordering of sections, if possible
     if (state == null || newState.sections.length !== state?.sections.length) {
       setState(newState);
@@ -66,6 +82,14 @@ export default function App(): React.Node {
     }
   }, [state, refreshState]);
 
+  const version = state?.version;
+  useEffect(() => {
+    // catch up on changes made while the tab was in the background
+    const onFocus = () => refreshState(version == null ? {} : { version });
+    window.addEventListener("focus", onFocus);
+    return () => window.removeEventListener("focus", onFocus);
+  }, [version, refreshState]);
+
   if (state == null) {
     return null;
   }
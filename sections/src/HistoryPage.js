@@ -3,15 +3,16 @@
 
 import "bootstrap/dist/css/bootstrap.css";
 import moment from "moment";
-import { useContext, useEffect, useState } from "react";
+import { useCallback, useContext, useEffect, useState } from "react";
 import * as React from "react";
+import Button from "react-bootstrap/Button";
 import Col from "react-bootstrap/Col";
 import Table from "react-bootstrap/Table";
 import Container from "react-bootstrap/Container";
 import Row from "react-bootstrap/Row";
 import { Link, Redirect } from "react-router-dom";
 import AttendanceRow from "./AttendanceRow";
-import type { ID, PersonDetails } from "./models";
+import type { AttendanceDetails, ID, PersonDetails } from "./models";
 import { sectionTitle } from "./models";
 import StateContext from "./StateContext";
 import useAPI from "./useAPI";
@@ -24,7 +25,17 @@ export default function HistoryPage({ userID }: Props): React.Node {
   const { currentUser } = useContext(StateContext);
   const [loadedUser, setLoadedUser] = useState<?PersonDetails>(null);
 
+  const [history, setHistory] = useState<Array<AttendanceDetails>>([]);
+  const [nextPage, setNextPage] = useState<?number>(null);
+
   const fetchUser = useAPI("fetch_user", setLoadedUser);
+  const fetchHistory = useAPI(
+    "fetch_attendance_history",
+    useCallback(({ attendanceHistory, nextPage: newNextPage }) => {
+      setHistory((currHistory) => currHistory.concat(attendanceHistory));
+      setNextPage(newNextPage);
+    }, [])
+  );
 
   useEffect(() => {
     if (userID != null) {
@@ -32,6 +43,11 @@ export default function HistoryPage({ userID }: Props): React.Node {
     }
   }, [userID, fetchUser]);
 
+  useEffect(() => {
+    setHistory([]);
+    fetchHistory({ user_id: userID, page: 0 });
+  }, [userID, fetchHistory]);
+
   if (
     (userID == null) === (currentUser?.isStaff === true) ||
     currentUser == null
@@ -64,7 +80,7 @@ export default function HistoryPage({ userID }: Props): React.Node {
               </tr>
             </thead>
             <tbody>
-              {user.attendanceHistory.map(({ section, session, status }, i) => (
+              {history.map(({ section, session, status }, i) => (
                 <tr key={i} className="text-center">
                   <td className="align-middle">
                     <b>{moment.unix(session.startTime).format("MMMM D")}</b>
@@ -85,6 +101,14 @@ export default function HistoryPage({ userID }: Props): React.Node {
               ))}
             </tbody>
           </Table>
+          {nextPage != null && (
+            <Button
+              variant="outline-secondary"
+              onClick={() => fetchHistory({ user_id: userID, page: nextPage })}
+            >
+              Load more
+            </Button>
+          )}
         </Col>
       </Row>
     </Container>
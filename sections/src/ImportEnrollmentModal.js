@@ -6,7 +6,8 @@ import Modal from "react-bootstrap/Modal";
 import FormControl from "react-bootstrap/FormControl";
 import { useContext, useState } from "react";
 import MessageContext from "./MessageContext";
-import useAPI from "./useStateAPI";
+import ToggleSwitch from "./ToggleSwitch";
+import useJobAPI from "./useJobAPI";
 
 type Props = {
   show: boolean,
@@ -15,10 +16,14 @@ type Props = {
 
 export default function ImportEnrollmentModal({ show, onClose }: Props) {
   const [sheet, setSheet] = useState("");
+  const [atomic, setAtomic] = useState(true);
 
   const { pushMessage } = useContext(MessageContext);
-  const importEnrollmentFromSheet = useAPI("import_enrollment_from_sheet", () =>
-    pushMessage("Import successful!")
+  const importEnrollmentFromSheet = useJobAPI("import_enrollment_from_sheet", (job) =>
+    pushMessage(
+      job.message ??
+        (job.status === "failed" ? "Import failed." : "Import successful!")
+    )
   );
 
   return (
@@ -51,12 +56,29 @@ export default function ImportEnrollmentModal({ show, onClose }: Props) {
           onChange={(e) => setSheet(e.target.value)}
           placeholder="Sheet URL"
         />
+        <p>
+          If any row is invalid, import nothing{" "}
+          <ToggleSwitch defaultChecked={atomic} onChange={setAtomic} />
+        </p>
+        <p>
+          Otherwise, valid rows are imported in batches and invalid ones are
+          reported once the import finishes.
+        </p>
       </Modal.Body>
       <Modal.Footer>
+        <Button
+          variant="secondary"
+          onClick={() => {
+            importEnrollmentFromSheet({ url: sheet, dry_run: true });
+            onClose();
+          }}
+        >
+          Check Sheet
+        </Button>
         <Button
           variant="success"
           onClick={() => {
-            importEnrollmentFromSheet({ url: sheet });
+            importEnrollmentFromSheet({ url: sheet, atomic });
             onClose();
           }}
         >
@@ -6,7 +6,8 @@ import Modal from "react-bootstrap/Modal";
 import FormControl from "react-bootstrap/FormControl";
 import { useContext, useState } from "react";
 import MessageContext from "./MessageContext";
-import useAPI from "./useStateAPI";
+import ToggleSwitch from "./ToggleSwitch";
+import useJobAPI from "./useJobAPI";
 
 type Props = {
   show: boolean,
@@ -15,10 +16,14 @@ type Props = {
 
 export default function ImportSectionsModal({ show, onClose }: Props) {
   const [sheet, setSheet] = useState("");
+  const [atomic, setAtomic] = useState(true);
 
   const { pushMessage } = useContext(MessageContext);
-  const importSectionsFromSheet = useAPI("import_sections_from_sheet", () =>
-    pushMessage("Import successful!")
+  const importSectionsFromSheet = useJobAPI("import_sections_from_sheet", (job) =>
+    pushMessage(
+      job.message ??
+        (job.status === "failed" ? "Import failed." : "Import successful!")
+    )
   );
 
   return (
@@ -51,12 +56,29 @@ export default function ImportSectionsModal({ show, onClose }: Props) {
           onChange={(e) => setSheet(e.target.value)}
           placeholder="Sheet URL"
         />
+        <p>
+          If any row is invalid, import nothing{" "}
+          <ToggleSwitch defaultChecked={atomic} onChange={setAtomic} />
+        </p>
+        <p>
+          Otherwise, valid rows are imported in batches and invalid ones are
+          reported once the import finishes.
+        </p>
       </Modal.Body>
       <Modal.Footer>
+        <Button
+          variant="secondary"
+          onClick={() => {
+            importSectionsFromSheet({ url: sheet, dry_run: true });
+            onClose();
+          }}
+        >
+          Check Sheet
+        </Button>
         <Button
           variant="success"
           onClick={() => {
-            importSectionsFromSheet({ url: sheet });
+            importSectionsFromSheet({ url: sheet, atomic });
             onClose();
           }}
         >
@@ -45,7 +45,7 @@ export default function SectionCardGroup({
 
   const numHiddenOpenSections = sections
     .slice(cardsPerRow)
-    .filter((section) => section.capacity > section.students.length).length;
+    .filter((section) => section.capacity > section.enrolledCount).length;
 
   const columns = Array(cardsPerRow)
     .fill()
@@ -11,6 +11,7 @@ export default React.createContext<{
   id: "",
   staff: null,
   students: [],
+  enrolledCount: 0,
   description: "",
   capacity: 0,
   startTime: 0,
@@ -26,6 +26,8 @@ export default React.createContext<{
   },
   currentUser: null,
   sections: [],
+  deletedSectionIds: null,
+  version: null,
   history: [],
   taughtSections: [],
   enrolledSections: [],
@@ -26,7 +26,7 @@ export default function StudentSectionCard({
   section,
 }: Props): React.MixedElement {
   const { config, currentUser, enrolledSections } = useContext(StateContext);
-  const hasSpace = section.capacity > section.students.length;
+  const hasSpace = section.capacity > section.enrolledCount;
   const enrolledInThisSection = enrolledSections?.some(
     (enrolledSection) => enrolledSection.id === section.id
   );
@@ -41,7 +41,7 @@ export default function StudentSectionCard({
   const unassignSection = useAPI("unassign_section");
 
   const sectionText = (
-    <>({section.capacity - section.students.length} spots left)</>
+    <>({section.capacity - section.enrolledCount} spots left)</>
   );
 
   const title = sectionTitle(section);
@@ -111,7 +111,7 @@ export default function StudentSectionCard({
             )}
           </Card.Title>
           <Card.Subtitle>
-            {Math.max(section.capacity - section.students.length, 0)}/
+            {Math.max(section.capacity - section.enrolledCount, 0)}/
             {section.capacity} spaces left
           </Card.Subtitle>
           <Card.Text>{section.description}</Card.Text>
@@ -26,7 +26,9 @@ export type Person = {
 export type Section = {
   id: ID,
   staff: ?Person,
+  // empty for students viewing a section they are not enrolled in
   students: Array<Person>,
+  enrolledCount: number,
   description: string,
   capacity: number,
   tags: Array<string>,
@@ -62,16 +64,16 @@ export type Session = {
   attendances: Array<Attendance>,
 };
 
-type AttendanceDetails = {
-  ...Attendance,
-  section: ?Section,
-  session: Session,
+export type AttendanceDetails = {
+  status: AttendanceStatusType,
+  section: ?{ id: ID, name: string, location: string, staff: ?Person },
+  session: { id: ID, startTime: Time },
 };
 
 export type PersonDetails = {
   ...Person,
   isAdmin?: boolean,
-  attendanceHistory: Array<AttendanceDetails>,
+  attendanceSummary?: { [AttendanceStatusType]: number },
 };
 
 // export type SlotDetails = {
@@ -85,6 +87,23 @@ export type SectionDetails = {
   // slots: Array<SlotDetails>,
 };
 
+export type DropCandidate = {
+  email: string,
+  name: string,
+  absences: number,
+  excused: number,
+};
+
+export type Job = {
+  id: ID,
+  kind: string,
+  status: "queued" | "running" | "succeeded" | "failed",
+  done: number,
+  total: ?number,
+  message: ?string,
+  result: ?{ students?: Array<DropCandidate>, [string]: string },
+};
+
 export type CourseConfig = {
   canStudentsJoinLab: boolean,
   canStudentsChangeLab: boolean,
@@ -105,6 +124,9 @@ export type State = {
   course: string,
   enrolledSections: ?Array<Section>,
   sections: Array<Section>,
+  // non-null when sections only holds the sections changed since version
+  deletedSectionIds: ?Array<ID>,
+  version: ?string,
   taughtSections: Array<Section>,
   currentUser: ?PersonDetails,
   config: CourseConfig,
@@ -112,7 +134,7 @@ export type State = {
 
 export const TZ = "America/Los_Angeles";
 
-export function sectionTitle(section: ?Section): React.MixedElement {
+export function sectionTitle(section: ?{ +staff: ?Person, ... }): React.MixedElement {
   return section == null ? (
     <>Deleted Section</>
   ) : (
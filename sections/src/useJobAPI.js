@@ -0,0 +1,56 @@
+// @flow strict
+
+import { useCallback, useContext } from "react";
+import post from "./common/post";
+import MessageContext from "./MessageContext";
+import type { Job } from "./models";
+import useStateAPI from "./useStateAPI";
+
+const POLL_INTERVAL_MS = 1000;
+const MAX_POLL_MS = 30 * 60 * 1000; // past this, leave the job running and stop waiting
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Calls an endpoint that starts a background job, then polls the job until it
+// finishes and refreshes the state it may have changed.
+export default function useJobAPI(method: string, callback: ?(Job) => mixed) {
+  const { pushMessage } = useContext(MessageContext);
+  const refreshState = useStateAPI("refresh_state");
+
+  const poll = useCallback(
+    async (jobId: string) => {
+      const deadline = Date.now() + MAX_POLL_MS;
+      while (Date.now() < deadline) {
+        // eslint-disable-next-line no-await-in-loop
+        await sleep(POLL_INTERVAL_MS);
+        // eslint-disable-next-line no-await-in-loop
+        const resp = await post("/api/fetch_job", { job_id: jobId }, true);
+        if (!resp.success) {
+          pushMessage(resp.message ?? "Unknown error.");
+          return;
+        }
+        const job: Job = resp.data;
+        if (job.status === "succeeded" || job.status === "failed") {
+          refreshState();
+          if (callback) {
+            callback(job);
+          }
+          return;
+        }
+      }
+      pushMessage("Stopped waiting for the job, which is still running.");
+    },
+    [callback, pushMessage, refreshState]
+  );
+
+  const start = useCallback(
+    ({ custom }) => {
+      if (custom?.jobId != null) {
+        poll(custom.jobId);
+      }
+    },
+    [poll]
+  );
+
+  return useStateAPI(method, start);
+}